@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# 命令路径性能测试, 结果以JSON输出, 用于版本间对比:
+# 1. encode: 每个_SET功能的命令生成耗时
+# 2. decode: 每个_GET功能的返回解析耗时(使用DEBUG值)
+# 3. roundtrip: 对虚拟电台(simulator.py)在各波特率下func_exec往返延迟的p50/p95/p99
+# 4. throughput: 各波特率下单条轮询和批量轮询(func_exec_many)的每秒命令数
+#
+# 用法: python benchmark.py -m FT-891 -o bench.json
+
+import re
+import json
+import time
+import platform
+import argparse
+
+import device
+import simulator
+
+BAUDRATES = (4800, 9600, 19200, 38400)
+
+def percentile(values, pct):
+    ''' 最近秩法百分位数, values需已排序 '''
+    if not values:
+        return
+    k = max(int(round(pct / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(k, len(values) - 1)]
+
+def sample_kwargs(func_conf):
+    ''' 为_SET功能构造一组合法参数: DIM取第一个维度值, CONVERT取0, 其余取'0' '''
+    kwargs = {}
+    dim = func_conf.get('DIM') or {}
+    convert = func_conf.get('CONVERT') or {}
+    for var in re.findall(r'\{\$(\w+)\}', func_conf['CMD']):
+        if isinstance(dim.get(var), dict):
+            kwargs[var] = sorted(dim[var].keys())[0]
+        elif convert.get(var) is not None:
+            kwargs[var] = 0
+        else:
+            kwargs[var] = '0'
+    return kwargs
+
+def timeit(fn, iterations):
+    ''' 返回单次调用耗时(纳秒) '''
+    begin = time.time()
+    for i in xrange(iterations):
+        fn()
+    return (time.time() - begin) / iterations * 1e9
+
+def bench_codec(rig, iterations):
+    ''' 编码/解码耗时, 不访问串口 '''
+    encode, decode = {}, {}
+    for func_name, plan in sorted(rig.get_plans().iteritems()):
+        if plan.is_get:
+            if plan.debug:
+                ret = plan.debug.rstrip(';')
+                decode[func_name] = timeit(lambda: plan.decode(ret), iterations)
+        else:
+            kwargs = sample_kwargs(rig.get_func(func_name))
+            encode[func_name] = timeit(lambda: plan.encode(kwargs), iterations)
+    return encode, decode
+
+def bench_link(rig, baudrate, funcs, iterations, duration, batch_size, latency):
+    ''' 在指定波特率下对虚拟电台测试往返延迟和吞吐 '''
+    sim = simulator.RIG_SIMULATOR(rig.model, baudrate, latency, rig=rig)
+    try:
+        if not rig.connect(sim.port, baudrate):
+            return
+
+        latencies = []
+        per_func = {}
+        errors = 0
+        for func_name in funcs:
+            samples = []
+            for i in xrange(iterations):
+                begin = time.time()
+                if rig.func_exec(func_name) is None:
+                    errors += 1
+                samples.append(time.time() - begin)
+            samples.sort()
+            per_func[func_name] = percentile(samples, 50) * 1e3
+            latencies.extend(samples)
+        latencies.sort()
+
+        # 单条轮询
+        count = 0
+        begin = time.time()
+        while time.time() - begin < duration:
+            rig.func_exec(funcs[count % len(funcs)])
+            count += 1
+        single = count / (time.time() - begin)
+
+        # 批量轮询
+        batch = funcs[:batch_size]
+        count = 0
+        begin = time.time()
+        while time.time() - begin < duration:
+            rig.func_exec_many(batch)
+            count += len(batch)
+        batched = count / (time.time() - begin)
+
+        return {
+            'roundtrip': {
+                'n': len(latencies),
+                'errors': errors,
+                'p50_ms': percentile(latencies, 50) * 1e3,
+                'p95_ms': percentile(latencies, 95) * 1e3,
+                'p99_ms': percentile(latencies, 99) * 1e3,
+                'per_func_p50_ms': per_func,
+                },
+            'throughput': {
+                'single_cps': single,
+                'batched_cps': batched,
+                'batch_size': len(batch),
+                },
+            }
+    finally:
+        rig.close(reset=True)
+        sim.close()
+
+def run(model='FT-891', bauds=BAUDRATES, funcs=None, codec_iterations=10000,
+    rt_iterations=20, duration=2.0, batch_size=10, latency=0.005):
+    rig = device.RIG_CREATOR().get(model)
+    if funcs is None:
+        funcs = sorted(name for name, plan in rig.get_plans().iteritems()
+            if plan.is_get and plan.debug and len(plan.parts) == 1)
+
+    encode, decode = bench_codec(rig, codec_iterations)
+    result = {
+        'meta': {
+            'model': model,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sim_latency_s': latency,
+            },
+        'encode_ns': encode,
+        'decode_ns': decode,
+        'link': {},
+        }
+    for baudrate in bauds:
+        result['link'][str(baudrate)] = bench_link(
+            rig, baudrate, funcs, rt_iterations, duration, batch_size, latency)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Yaesu CAT command path benchmark')
+    parser.add_argument('-m', '--model', default='FT-891')
+    parser.add_argument('-o', '--output', help='JSON输出文件, 默认标准输出')
+    parser.add_argument('-b', '--bauds', type=int, nargs='+', default=list(BAUDRATES))
+    parser.add_argument('-f', '--funcs', nargs='+', help='测试的_GET功能, 默认全部')
+    parser.add_argument('--codec-iterations', type=int, default=10000)
+    parser.add_argument('--rt-iterations', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=2.0, help='吞吐测试时长(秒)')
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.005, help='虚拟电台处理延迟(秒)')
+    args = parser.parse_args()
+
+    result = run(args.model, args.bauds, args.funcs, args.codec_iterations,
+        args.rt_iterations, args.duration, args.batch_size, args.latency)
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print output
+
+if __name__ == '__main__':
+    main()
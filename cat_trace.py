@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# 抓包文件(rig.trace_start)的离线分析和回放:
+# 1. iter_records 流式读取, 文件大小不受内存限制
+# 2. decode 将接收帧按命令前缀归入_GET功能, 每组累积一块后按RET/DIM/CONVERT批量解码,
+#    以列式块输出(每行一个JSON: {"FUNC": 功能名, "TIME": [...], 返回名: [...]})
+# 3. replay 将发送帧按原时间间隔(或尽快)发往串口(如simulator.py的虚拟电台), 比对接收帧
+#
+# 用法: python cat_trace.py stats session.trc
+#       python cat_trace.py decode session.trc -o session.jsonl
+#       python cat_trace.py replay session.trc -r /dev/pts/3 -s 38400 --speed 0
+# (模块不命名为trace, 避免覆盖标准库)
+
+import sys
+import json
+import time
+import argparse
+import threading
+import serial
+
+import device
+
+CHUNK_SIZE = 1 << 20
+
+def read_header(f):
+    ''' 读取文件头, 返回 {MODEL, START_TIME, START_CLOCK} '''
+    head = f.read(device.TRACE_HEADER.size)
+    magic, version, start_time, start_clock, size = device.TRACE_HEADER.unpack(head)
+    assert magic == device.TRACE_MAGIC, 'not a trace file.'
+    assert version == device.TRACE_VERSION, 'unsupported trace version: %d' % version
+    return {'MODEL': f.read(size), 'START_TIME': start_time, 'START_CLOCK': start_clock}
+
+def iter_records(path, header=None):
+    '''
+    流式读取抓包记录, 生成 (时间戳, 方向, 帧). 时间戳已换算为time.time()时间.
+    header: 传入dict时填入文件头信息. 不完整的尾记录忽略.
+    '''
+    record = device.TRACE_RECORD
+    with open(path, 'rb') as f:
+        info = read_header(f)
+        if header is not None:
+            header.update(info)
+        offset = info['START_TIME'] - info['START_CLOCK']
+        buf = ''
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            buf += chunk
+            pos, end = 0, len(buf)
+            while pos + record.size <= end:
+                ts, direction, size = record.unpack_from(buf, pos)
+                start = pos + record.size
+                if start + size > end:
+                    break
+                yield ts + offset, direction, buf[start:start + size]
+                pos = start + size
+            buf = buf[pos:]     # 跨块的不完整记录留到下一块
+
+def get_index(rig):
+    ''' _GET计划按前缀长度倒序, 优先匹配最长前缀 '''
+    return sorted((plan for plan in rig.get_plans().itervalues() if plan.is_get),
+        key=lambda plan: len(plan.prefix), reverse=True)
+
+def match_plan(index, frame):
+    for plan in index:
+        if frame.startswith(plan.prefix) and len(frame) >= plan.ret_len:
+            return plan
+
+def stats(path):
+    ''' 按方向和命令前缀(前2个字符)统计帧数 '''
+    header = {}
+    counts = {}
+    first = last = None
+    for ts, direction, frame in iter_records(path, header):
+        key = ('TX' if direction == device.TRACE_TX else 'RX', frame[:2])
+        counts[key] = counts.get(key, 0) + 1
+        first = ts if first is None else first
+        last = ts
+    header['DURATION'] = (last - first) if first is not None else 0
+    header['FRAMES'] = dict(('%s %s' % k, v) for k, v in counts.iteritems())
+    return header
+
+def decode(path, rig=None, block=4096):
+    '''
+    批量解码接收帧, 生成列式块 (功能名, {'TIME': [...], 返回名: [...]}).
+    rig: 提供配置的YAESU_CAT实例, 默认按文件头中的型号创建
+    block: 每个功能累积的帧数, 达到后解码输出一块
+    '''
+    header = {}
+    records = iter_records(path, header)
+    groups = {}     # 功能名 -> (计划, 时间列表, 帧列表)
+    index = None
+    unknown = 0
+    for ts, direction, frame in records:
+        if index is None:
+            rig = rig or device.RIG_CREATOR().get(header['MODEL'])
+            index = get_index(rig)
+        if direction <> device.TRACE_RX:
+            continue
+        plan = match_plan(index, frame)
+        if plan is None:
+            unknown += 1
+            continue
+        group = groups.get(plan.name)
+        if group is None:
+            group = groups[plan.name] = (plan, [], [])
+        group[1].append(ts)
+        group[2].append(frame)
+        if len(group[2]) >= block:
+            yield plan.name, _decode_block(plan, group[1], group[2])
+            del group[1][:], group[2][:]
+    for name, (plan, times, frames) in sorted(groups.iteritems()):
+        if frames:
+            yield name, _decode_block(plan, times, frames)
+    if unknown:
+        (rig.logger if rig else device.get_logger()).info('trace decode: %d unknown frames.' % unknown)
+
+def _decode_block(plan, times, frames):
+    columns = plan.decode_many(frames)
+    columns['TIME'] = list(times)
+    return columns
+
+def replay(path, port, baudrate=38400, speed=1.0, timeout=1.0, max_diff=20):
+    '''
+    回放抓包中的发送帧, 比对接收帧.
+    speed: 1.0为原速, 2.0为两倍速, 0为尽快发送(仍按原顺序, 同一时刻的帧一次写入)
+    timeout: 发送完毕后等待剩余接收帧的时间(秒)
+    返回 {SENT, EXPECTED, RECEIVED, MATCHED, DIFF: [(序号, 原接收帧, 回放接收帧), ...]}
+    '''
+    conn = serial.Serial(port, baudrate, timeout=0.05)
+    reader = device.FRAME_READER(conn)
+    received = []
+    running = [True]
+    def read_loop():
+        while running[0]:
+            frame = reader.read_frame(0.2)
+            if frame is not None:
+                received.append(frame)
+    thread = threading.Thread(target=read_loop, name='REPLAY')
+    thread.daemon = True
+    thread.start()
+
+    expected = []
+    sent = 0
+    pending, pending_ts = [], None
+    begin, first = time.time(), None
+    try:
+        for ts, direction, frame in iter_records(path):
+            if direction == device.TRACE_RX:
+                expected.append(frame)
+                continue
+            if ts <> pending_ts and pending:
+                sent += _send(conn, pending, pending_ts, first, begin, speed)
+                pending = []
+            if first is None:
+                first = ts
+            pending.append(frame)
+            pending_ts = ts
+        if pending:
+            sent += _send(conn, pending, pending_ts, first, begin, speed)
+
+        deadline = time.time() + timeout
+        while len(received) < len(expected) and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        running[0] = False
+        thread.join()
+        conn.close()
+
+    diff = [(i, e, g) for i, (e, g) in enumerate(map(None, expected, received)) if e <> g]
+    return {
+        'SENT': sent,
+        'EXPECTED': len(expected),
+        'RECEIVED': len(received),
+        'MATCHED': max(len(expected), len(received)) - len(diff),
+        'DIFF': diff[:max_diff],
+        }
+
+def _send(conn, frames, ts, first, begin, speed):
+    if speed:
+        delay = begin + (ts - first) / speed - time.time()
+        if delay > 0:
+            time.sleep(delay)
+    conn.write(''.join(f + ';' for f in frames))
+    conn.flush()
+    return len(frames)
+
+def main():
+    parser = argparse.ArgumentParser(description='Yaesu CAT trace tools')
+    parser.add_argument('action', choices=['stats', 'decode', 'replay'])
+    parser.add_argument('path', help='抓包文件')
+    parser.add_argument('-o', '--output', help='decode输出文件(JSON lines), 默认标准输出')
+    parser.add_argument('-b', '--block', type=int, default=4096, help='decode每块帧数')
+    parser.add_argument('-r', '--rig-file', help='replay串口设备')
+    parser.add_argument('-s', '--serial-speed', type=int, default=38400)
+    parser.add_argument('--speed', type=float, default=1.0, help='replay倍速, 0为尽快')
+    args = parser.parse_args()
+
+    if args.action == 'stats':
+        print json.dumps(stats(args.path), indent=2, sort_keys=True)
+    elif args.action == 'decode':
+        out = open(args.output, 'w') if args.output else sys.stdout
+        try:
+            for func_name, columns in decode(args.path, block=args.block):
+                columns['FUNC'] = func_name
+                out.write(json.dumps(columns, sort_keys=True) + '\n')
+        finally:
+            if args.output:
+                out.close()
+    else:
+        if not args.rig_file:
+            parser.error('replay needs -r')
+        result = replay(args.path, args.rig_file, args.serial_speed, args.speed)
+        print json.dumps(result, indent=2, sort_keys=True)
+        sys.exit(0 if not result['DIFF'] else 1)
+
+if __name__ == '__main__':
+    main()
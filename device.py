@@ -7,20 +7,37 @@
 
 import os
 import re
+import ast
 import sys
 import yaml
 import time
 import copy
+import errno
+import Queue
+import threading
+import collections
+import struct
+import marshal
+import hashlib
+import bisect
 import logging
 import serial
 import serial.tools.list_ports
 
+# numpy为可选依赖, 用于批量编码/解码(CMD_PLAN.encode_many/decode_many), 未安装时使用纯Python实现
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class Logger(logging.Logger):
     # 日志记录类, 输出日志到控制台和日志文件
     # DEBUG - INFO - WARNING - ERROR - CRITICAL
-    # 为缩小日志文件, 日志文件记录INFO及以上; 控制台输出WARNING及以上
-    def __init__(self, filename='main.log'):
-        super(Logger, self).__init__(self)
+    # 默认记录DEBUG及以上(含收发明细), 不需要时 get_logger(level=logging.INFO),
+    # 此时调试信息不再格式化.
+    # 每个实例都会打开一次日志文件, 一般通过get_logger()共用同一个实例.
+    def __init__(self, filename='main.log', level=logging.DEBUG):
+        super(Logger, self).__init__('yaesu_cat', level)
         
         if not os.path.exists(filename):
             f = open(filename, 'w')
@@ -40,25 +57,570 @@ class Logger(logging.Logger):
         self.addHandler(fh) 
         self.addHandler(ch)
 
+_loggers = {}
+_loggers_lock = threading.Lock()
+
+def get_logger(filename='main.log', level=None):
+    '''
+    返回写入filename的共用Logger, 同一文件只创建一次(只打开一个FileHandler).
+    level: 设置日志级别(如logging.INFO), None为不改变(默认DEBUG)
+    '''
+    with _loggers_lock:
+        if not _loggers.has_key(filename):
+            _loggers[filename] = Logger(filename)
+        if level is not None:
+            _loggers[filename].setLevel(level)
+        return _loggers[filename]
+
+# CONVERT表达式允许的语法节点: 数字, 变量x, 四则运算/乘方/取模
+_EXPS_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Num, ast.Name, ast.Load,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.UAdd, ast.USub,
+    )
+
+def compile_exps(exps):
+    ''' 将CONVERT表达式编译为单参数函数f(x), 不允许表达式中出现x以外的名称和调用 '''
+    exps = str(exps).strip()
+    tree = ast.parse(exps, mode='eval')
+    for node in ast.walk(tree):
+        assert isinstance(node, _EXPS_NODES), 'unsafe CONVERT expression: %s' % exps
+        if isinstance(node, ast.Name):
+            assert node.id == 'x', 'unknown var [%s] in CONVERT expression: %s' % (node.id, exps)
+    return eval('lambda x: (%s)' % exps, {'__builtins__': {}})
+
+def _to_num(val):
+    ''' SET参数转为数值, 兼容以字符串传入的数值 '''
+    if isinstance(val, basestring):
+        try:
+            return int(val)
+        except ValueError:
+            return float(val)
+    return val
+
+# 串口调度优先级: 数值越小越优先, 由配置中的PRIO指定, 默认为交互类
+PRIO_SAFETY = 0         # 发射控制等安全相关(MOX_SET, TX_SETTING_SET, SPLIT_SET)
+PRIO_INTERACTIVE = 1    # 用户操作
+PRIO_BACKGROUND = 2     # 后台轮询(表头遥测)
+PRIO_CLASSES = (PRIO_SAFETY, PRIO_INTERACTIVE, PRIO_BACKGROUND)
+
+class PRIO_SCHEDULER(object):
+    # 串口占用的优先级调度, 代替单一的互斥锁:
+    # 1. 串口空闲时交给等待中有效优先级最高者, 同级按到达顺序
+    # 2. 防饿死: 每等待aging秒, 有效优先级提升一级, 但最多提升到PRIO_INTERACTIVE,
+    #    安全类(PRIO_SAFETY)命令不会被等待已久的低优先级命令超越
+    # 3. 各优先级的链路预算(占链路字节速率的比例), 超出预算的等待者暂不调度
+    # 同一线程可重入. 占用时长由调用方控制(有更高优先级等待者时批量命令分块执行), 以限制高优先级的等待上限.
+    def __init__(self, byte_time, budgets=None, aging=1.0):
+        '''
+        byte_time: 返回当前单字节传输时间(秒)的函数
+        budgets: {优先级: 链路占比(0~1)}, 未列出的优先级不限
+        '''
+        self.byte_time = byte_time
+        self.budgets = dict(budgets) if budgets is not None else {PRIO_BACKGROUND: 0.5}
+        self.aging = aging
+        self.__cond = threading.Condition(threading.Lock())
+        self.__owner = None
+        self.__depth = 0
+        self.__waiters = []     # [到达时间, 序号, 优先级, 字节数]
+        self.__seq = 0
+        self.__tokens = {}      # 优先级 -> [剩余字节, 上次补充时间]
+        self.granted = dict((prio, 0) for prio in PRIO_CLASSES)    # 各优先级获得次数
+
+    def __refill(self, prio, now):
+        ''' 令牌桶补充, 返回剩余字节; 不限预算返回None '''
+        share = self.budgets.get(prio)
+        if share is None:
+            return
+        rate = share / self.byte_time()         # 字节/秒
+        bucket = self.__tokens.setdefault(prio, [rate, now])
+        bucket[0] = min(rate, bucket[0] + (now - bucket[1]) * rate)    # 最多积累1秒
+        bucket[1] = now
+        return bucket[0]
+
+    def __pick(self, now):
+        ''' 选出下一个可调度的等待者, 并返回预算不足者最早可调度的等待时间 '''
+        best, retry = None, None
+        for waiter in self.__waiters:
+            arrive, seq, prio, nbytes = waiter
+            tokens = self.__refill(prio, now)
+            if tokens is not None and tokens < min(nbytes, 1):
+                wait = (min(nbytes, 1) - tokens) * self.byte_time() / self.budgets[prio]
+                retry = wait if retry is None else min(retry, wait)
+                continue
+            if prio > PRIO_SAFETY:
+                prio = max(prio - int((now - arrive) / self.aging), PRIO_SAFETY + 1)
+            key = (prio, seq)
+            if best is None or key < best[0]:
+                best = (key, waiter)
+        return (best[1] if best else None), retry
+
+    def acquire(self, prio=PRIO_INTERACTIVE, nbytes=0):
+        ''' 按优先级等待占用串口, nbytes为本次收发字节数, 计入该优先级预算 '''
+        me = threading.current_thread()
+        with self.__cond:
+            if self.__owner is me:
+                self.__depth += 1
+                return
+            self.__seq += 1
+            waiter = [time.time(), self.__seq, prio, nbytes]
+            self.__waiters.append(waiter)
+            while True:
+                retry = None
+                if self.__owner is None:
+                    chosen, retry = self.__pick(time.time())
+                    if chosen is waiter:
+                        break
+                # 有等待者因预算或防饿死改变顺序时需定时重新选择
+                self.__cond.wait(retry if retry is not None else (self.aging if len(self.__waiters) > 1 else None))
+            self.__waiters.remove(waiter)
+            self.__owner = me
+            self.__depth = 1
+            bucket = self.__tokens.get(prio)
+            if bucket is not None:
+                bucket[0] -= nbytes
+            self.granted[prio] += 1
+
+    def release(self):
+        with self.__cond:
+            assert self.__owner is threading.current_thread(), 'release by non-owner.'
+            self.__depth -= 1
+            if not self.__depth:
+                self.__owner = None
+                self.__cond.notify_all()
+
+    def hold(self, prio=PRIO_INTERACTIVE, nbytes=0):
+        ''' with rig_scheduler.hold(prio, nbytes): ... '''
+        return _SCHED_HOLD(self, prio, nbytes)
+
+    def urgent(self, prio):
+        ''' 是否有比prio更高优先级(按配置优先级, 不计防饿死提升)的等待者 '''
+        with self.__cond:
+            for waiter in self.__waiters:
+                if waiter[2] < prio:
+                    return True
+            return False
+
+    def waiting(self):
+        ''' 各优先级等待数 '''
+        with self.__cond:
+            ret = dict((prio, 0) for prio in PRIO_CLASSES)
+            for waiter in self.__waiters:
+                ret[waiter[2]] = ret.get(waiter[2], 0) + 1
+            return ret
+
+class _SCHED_HOLD(object):
+    def __init__(self, sched, prio, nbytes):
+        self.sched, self.prio, self.nbytes = sched, prio, nbytes
+
+    def __enter__(self):
+        self.sched.acquire(self.prio, self.nbytes)
+
+    def __exit__(self, *exc):
+        self.sched.release()
+
+class CMD_PLAN(object):
+    # 命令执行计划, 由单个_GET/_SET功能配置编译而来(RIG_CREATOR.get中完成).
+    # func_exec执行时只访问计划中预先解析好的属性, 不再查找配置字典和eval.
+    #   parts:   CMD模板按参数拆分, 偶数位为常量, 奇数位为参数名
+    #   params:  参数名 -> 编码函数(DIM查表/CONVERT计算并按FORM补齐/原样)
+    #   rets:    (返回名, 起, 止, 解码函数), 解码函数为None时原样返回
+    # 批量编码/解码(encode_many/decode_many)时, CONVERT参数和返回值在安装numpy时按数组计算.
+    def __init__(self, func_name, func_conf):
+        self.name = func_name
+        self.is_get = func_name.endswith('_GET')
+        self.cmd = func_conf['CMD']
+        self.debug = func_conf.get('DEBUG')
+        self.ttl = func_conf.get('TTL')     # 读缓存有效期(秒), None时使用缓存的默认值
+        self.prio = func_conf.get('PRIO', PRIO_INTERACTIVE)     # 串口调度优先级
+        self.get_name = func_name[:-4] + '_GET'     # 同名_GET
+        # SET执行后需失效的读缓存: 同名_GET及解析本SET所写字段的_GET(如VFO_A_FREQ_SET -> VFO_A_GET), 由compile_conf填写
+        self.invalidates = (self.get_name,)
+
+        dim = func_conf.get('DIM') or {}
+        convert = func_conf.get('CONVERT') or {}
+
+        self.parts = tuple(re.split(r'\{\$(\w+)\}', self.cmd))
+        self.prefix = self.parts[0].rstrip(';')
+        self.params = {}
+        # CONVERT表达式, 供numpy批量计算: 参数名 -> (表达式, FORM), 返回名 -> 表达式
+        self.__encode_vectors = {}
+        self.__decode_vectors = {}
+        for var in self.parts[1::2]:
+            self.params[var] = self.__encoder(var, dim.get(var), convert.get(var))
+
+        self.rets = []
+        self.ret_len = 0
+        if self.is_get:
+            for k, v in (func_conf.get('RET') or {}).iteritems():
+                begin, end = [int(i) for i in str(v).split(',')]
+                self.rets.append((k, begin, end, self.__decoder(k, dim.get(k), convert.get(k))))
+                self.ret_len = max(self.ret_len, end)
+
+    def __encoder(self, var, dim, convert):
+        ''' 生成SET参数编码函数, 按顺序尝试: DIM(转码), CONVERT(值转换), 直接替换 '''
+        func_name = self.name
+        if isinstance(dim, dict):
+            def encode(val):
+                arg_code = dim.get(val)
+                assert arg_code is not None and not arg_code.strip().isspace(), 'no [%s] in DIM: %s - %s' % (val, func_name, var)
+                return arg_code
+        elif convert is not None:
+            assert isinstance(convert, dict) and convert.get('EXPS') is not None \
+                and convert.get('FORM') is not None, 'func [%s] CONVERT with invalid config.' % func_name
+            exps = compile_exps(convert['EXPS'])
+            form = str(convert['FORM']).split('|')
+            if form[0] in ('L', 'R'):
+                width, fill = int(form[1]), form[2]
+                pad = str.ljust if form[0] == 'L' else str.rjust
+            else:   # 若FORM无法识别, 则默认将转换后的数值作为字符串直接使用
+                width, fill, pad = 0, ' ', str.rjust
+            self.__encode_vectors[var] = (exps, (pad is str.ljust, width, fill))
+            def encode(val):
+                return pad(str(int(round(exps(_to_num(val))))), width, fill)
+        else:
+            encode = str
+        return encode
+
+    def __decoder(self, k, dim, convert):
+        ''' 生成RET解码函数, 按顺序尝试: DIM(转码), CONVERT(值转换, 整型), 原值返回(None) '''
+        if isinstance(dim, dict):
+            return lambda seg: dim.get(seg, 'UNKNOWN')
+        elif convert is not None:
+            # 目前值转换格式只允许转换为整型, 用于数值类返回
+            # 同时作为GET参数的返回值, 配置为EXPS/FORM格式, 取其EXPS
+            if isinstance(convert, dict):
+                convert = convert.get('EXPS')
+            exps = compile_exps(convert)
+            self.__decode_vectors[k] = exps
+            return lambda seg: int(round(exps(int(seg))))
+        return None
+
+    def encode(self, kwargs):
+        ''' 按参数生成命令, 未传入的参数保留{$XX}, 由调用方检查 '''
+        parts = self.parts
+        if len(parts) == 1:
+            return self.cmd
+        cmd = [parts[0]]
+        for i in xrange(1, len(parts), 2):
+            var = parts[i]
+            if var in kwargs:
+                cmd.append(self.params[var](kwargs[var]))
+            else:
+                cmd.append('{$%s}' % var)
+            cmd.append(parts[i + 1])
+        return ''.join(cmd)
+
+    def encode_many(self, columns, count=None):
+        '''
+        批量编码, columns为 {参数名: 值列表或单个值}, 单个值用于全部命令, 返回命令列表.
+        各值列表需等长, 全部为单个值时生成count条. 不允许缺少参数.
+        '''
+        parts = self.parts
+        for var in parts[1::2]:
+            assert var in columns, 'missing var [%s]: %s' % (var, self.name)
+            values = columns[var]
+            if not _is_scalar(values):
+                assert count is None or count == len(values), 'columns of different length: %s' % self.name
+                count = len(values)
+        if count is None:
+            count = 1
+        if len(parts) == 1:
+            return [self.cmd] * count
+
+        cols = []
+        for var in parts[1::2]:
+            values = columns[var]
+            if _is_scalar(values):
+                cols.append([self.params[var](values)] * count)
+            else:
+                cols.append(self.__encode_column(var, values))
+        template = '%s'.join(part.replace('%', '%%') for part in parts[0::2])
+        return [template % row for row in zip(*cols)]
+
+    def __encode_column(self, var, values):
+        ''' 编码一列参数值, CONVERT参数在安装numpy且行数足够时按数组计算 '''
+        vector = self.__encode_vectors.get(var)
+        if vector is None or numpy is None or len(values) < NUMPY_MIN_ROWS:
+            return map(self.params[var], values)
+        exps, (left, width, fill) = vector
+        x = numpy.asarray(values)
+        if x.dtype.kind in 'SU':    # 以字符串传入的数值, 与_to_num相同优先按整型
+            if not all(isinstance(v, basestring) for v in values):
+                return map(self.params[var], values)    # 字符串与数值混合, numpy会将数值转为字符串
+            try:
+                x = x.astype(numpy.int64)
+            except ValueError:
+                x = x.astype(numpy.float64)
+        elif x.dtype.kind not in 'biuf':
+            return map(self.params[var], values)
+        codes = _round_int(_vector_exps(exps, x)).astype('S')
+        if width:
+            # numpy.char.rjust/ljust会截断超过width的字符串, 只补齐较短的
+            padded = (numpy.char.ljust if left else numpy.char.rjust)(codes, width, fill)
+            codes = numpy.where(numpy.char.str_len(codes) < width, padded, codes)
+        return codes.tolist()
+
+    def decode(self, ret):
+        ''' 按RET截取返回结果并转换, 返回字典. 返回长度不足(丢字节)时抛出ValueError '''
+        if len(ret) < self.ret_len:
+            raise ValueError('short reply: %s' % ret)
+        cmd_ret = {}
+        for k, begin, end, conv in self.rets:
+            seg = ret[begin:end]
+            cmd_ret[k] = conv(seg) if conv is not None else seg
+        return cmd_ret
+
+    def decode_many(self, frames):
+        '''
+        批量解码, 按列返回 {返回名: [值, ...]}, 与frames等长.
+        frames需均不短于ret_len; 个别帧解码失败时该位置为None.
+        安装numpy且各帧等长时, 按字节矩阵切片, CONVERT返回值按数组计算.
+        '''
+        matrix = None
+        if numpy is not None and len(frames) >= NUMPY_MIN_ROWS:
+            width = len(frames[0])
+            if width >= self.ret_len and all(len(f) == width for f in frames):
+                matrix = numpy.frombuffer(''.join(frames), numpy.uint8).reshape(len(frames), width)
+
+        columns = {}
+        for k, begin, end, conv in self.rets:
+            if matrix is not None:
+                if k in self.__decode_vectors:
+                    values = _decode_digits(matrix[:, begin:end], self.__decode_vectors[k])
+                    if values is not None:
+                        columns[k] = values
+                        continue
+                segs = matrix[:, begin:end].copy().view('S%d' % (end - begin)).ravel().tolist()
+            else:
+                segs = [f[begin:end] for f in frames]
+            if conv is None:
+                columns[k] = segs
+                continue
+            try:
+                columns[k] = map(conv, segs)
+            except (ValueError, TypeError):
+                columns[k] = [_safe_call(conv, seg) for seg in segs]
+        return columns
+
+def _safe_call(conv, seg):
+    try:
+        return conv(seg)
+    except (ValueError, TypeError):
+        return
+
+NUMPY_MIN_ROWS = 32     # 少于此行数时numpy的数组开销大于收益, 使用纯Python实现
+
+def _is_scalar(value):
+    return isinstance(value, basestring) or not hasattr(value, '__len__')
+
+def _round_int(y):
+    '''
+    与python2的int(round(y))一致: 四舍五入远离零(numpy.round为银行家舍入).
+    floor(|y|+0.5)在|y|+0.5不能精确表示时可能进位(如0.49999999999999994), 需修正.
+    '''
+    y = numpy.asarray(y)
+    if y.dtype.kind != 'f':
+        return y.astype(numpy.int64)
+    a = numpy.abs(y)
+    r = numpy.floor(a + 0.5)
+    r -= (r - 0.5) > a
+    return (numpy.copysign(r, y)).astype(numpy.int64)
+
+def _decode_digits(digits, exps):
+    ''' 将全为数字的字节矩阵按行转为整数并计算CONVERT表达式, 含非数字(符号, 空格)时返回None '''
+    if not digits.shape[1]:
+        return
+    digits = digits.astype(numpy.int64) - 48
+    if digits.min() < 0 or digits.max() > 9:
+        return
+    x = digits.dot(10 ** numpy.arange(digits.shape[1] - 1, -1, -1, dtype=numpy.int64))
+    return _round_int(_vector_exps(exps, x)).tolist()
+
+def _vector_exps(exps, x):
+    ''' 按数组计算CONVERT表达式, 不含x的常量表达式扩展为等长数组 '''
+    y = numpy.asarray(exps(x))
+    return y if y.ndim else numpy.repeat(y, len(x))
+
+def compile_conf(conf):
+    ''' 将合并后的配置编译为 {功能名: CMD_PLAN}, 配置有误时抛出AssertionError '''
+    plans = {}
+    for func_name, func_conf in conf.iteritems():
+        if func_name.endswith('_GET') or func_name.endswith('_SET'):
+            plans[func_name] = CMD_PLAN(func_name, func_conf)
+
+    # 字段名 -> 解析该字段的_GET, SET写入的字段对应的_GET在SET执行后一并失效
+    readers = {}
+    for plan in plans.itervalues():
+        if plan.is_get:
+            for k, begin, end, conv in plan.rets:
+                readers.setdefault(k, set()).add(plan.name)
+    for plan in plans.itervalues():
+        if not plan.is_get:
+            names = set([plan.get_name])
+            for var in plan.params:
+                names.update(readers.get(var, ()))
+            plan.invalidates = tuple(sorted(names))
+    return plans
+
+# 优先使用libyaml的C解析器, 未编译libyaml时退回纯Python实现
+_YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+def yaml_load(stream):
+    ''' 解析YAML配置 '''
+    return yaml.load(stream, Loader=_YAML_LOADER)
+
+# 编译配置缓存: 合并并检查后的配置按型号以marshal格式保存,
+# 源文件(路径, mtime, 大小, sha1)任一变化即重新生成. 格式变化时修改版本号.
+CONF_CACHE_DIR = 'conf/.cache'
+CONF_CACHE_VERSION = 1
+
+def _file_sign(path):
+    ''' 源文件签名 (路径, mtime, 大小, sha1) '''
+    st = os.stat(path)
+    with open(path, 'rb') as f:
+        sha1 = hashlib.sha1(f.read()).hexdigest()
+    return (path, st.st_mtime, st.st_size, sha1)
+
+def _sign_valid(sign):
+    ''' mtime和大小未变即视为有效, 否则比较sha1(如git checkout只改变mtime) '''
+    path, mtime, size, sha1 = sign
+    try:
+        st = os.stat(path)
+        if st.st_mtime == mtime and st.st_size == size:
+            return True
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest() == sha1
+    except (OSError, IOError):
+        return False
+
+# 自动检测成功的设备 (HWID, PORT, BAUDRATE, MODEL), 下次检测时优先尝试
+LAST_RIG_FILE = 'last_rig'
+# 自动检测时尝试的波特率顺序
+PROBE_BAUDRATES = (38400, 4800, 9600, 19200)
+
+def load_last_rig(cache_dir=CONF_CACHE_DIR):
+    ''' 读取上次检测成功的设备, 无记录返回None '''
+    if cache_dir is None:
+        return
+    try:
+        with open(os.path.join(cache_dir, LAST_RIG_FILE), 'rb') as f:
+            return marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        return
+
+def save_last_rig(found, cache_dir=CONF_CACHE_DIR):
+    ''' 保存检测成功的设备 '''
+    if cache_dir is None:
+        return
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(os.path.join(cache_dir, LAST_RIG_FILE), 'wb') as f:
+            marshal.dump(dict(found), f)
+    except (IOError, OSError):
+        pass    # 仅影响下次检测速度
+
 class RIG_CREATOR(object):
     # 设备工厂类, 用来配置并产生指定型号的类实例. 此类中不要求连接设备,
     # 只提供命令配置检查和传入, 设备连接在rig.connect中完成.
-    def __init__(self):
-        ''' 初始化设备配置列表 '''
+    def __init__(self, cache_dir=CONF_CACHE_DIR):
+        '''
+        初始化设备配置列表
+        cache_dir: 编译配置缓存目录, None为不使用缓存
+        '''
         with open('conf/support_model.yaml','r') as f:
-            self.__config_dict = yaml.load(f)['RADIO_CONF']
-        self.logger = Logger()
+            support = yaml_load(f)
+        self.__config_dict = support['RADIO_CONF']
+        # ID命令返回码 -> 型号, 合并各品牌
+        self.__radio_id = {}
+        for brand_ids in (support.get('RADIO_ID') or {}).itervalues():
+            self.__radio_id.update(brand_ids or {})
+        self.cache_dir = cache_dir
+        self.logger = get_logger()
+
+    def model_of(self, radio_id):
+        '''
+        按RADIO_ID将ID返回码映射为RADIO_CONF中的型号. 派生型号(如FT-991A, FT-450D)
+        未单独配置时使用基础型号(FT-991, FT-450), 无法识别返回None.
+        '''
+        model = self.__radio_id.get(radio_id)
+        if model is None:
+            self.logger.warning('unknown radio ID: %s' % radio_id)
+            return
+        if self.__config_dict.has_key(model):
+            return model
+        if model[-1].isalpha() and self.__config_dict.has_key(model[:-1]):
+            self.logger.info('model %s uses config of %s.' % (model, model[:-1]))
+            return model[:-1]
+        self.logger.warning('unsupported model: %s (ID %s)' % (model, radio_id))
+
+    def detect(self, ports=None, bauds=PROBE_BAUDRATES, timeout=1.0):
+        '''
+        检测串口上的设备, 返回 [{HWID, PORT, BAUDRATE, ID, MODEL}, ...]:
+        1. 先以上次检测成功的 (HWID, BAUDRATE) 尝试, 成功则直接返回
+        2. 否则所有串口并行探测, 每个串口依次尝试各波特率, 发送ID;并按波特率设置短超时
+        ports: 串口设备路径列表, 默认为 serial.tools.list_ports 列出的全部串口
+        timeout: 并行探测的总等待时间(秒)
+        '''
+        if ports is None:
+            candidates = [(p.device, p.hwid) for p in serial.tools.list_ports.comports()]
+        else:
+            candidates = [(p, p) for p in ports]
+        if not candidates:
+            self.logger.warning('No available serial port.')
+            return []
+
+        last = load_last_rig(self.cache_dir)
+        if last:
+            for port, hwid in candidates:
+                if hwid == last.get('HWID') or port == last.get('PORT'):
+                    radio_id = probe_id(port, (last.get('BAUDRATE'),))
+                    if radio_id and self.model_of(radio_id[1]):
+                        self.logger.info('last rig found: %s@%s' % (port, radio_id[0]))
+                        return [self.__found(port, hwid, radio_id)]
+                    break
 
-    def auto_match(self):
-        # 查找tty/ttyUSB, 尝试以不同速率连接.
-        # TODO: 1. 完成yeasu_cat3协议的自动匹配
-        #       2. 支持更多品牌和协议
-        model = ''
-        for baudrate in (4800, 9600, 19200, 38400):
-            for p in serial.tools.list_ports.comports():
-                auto_rig = serial.Serial(p.device, baudrate)
+        results = {}
+        def worker(port):
+            results[port] = probe_id(port, bauds)
+        threads = []
+        for port, hwid in candidates:
+            t = threading.Thread(target=worker, args=(port,), name='PROBE-%s' % port)
+            t.daemon = True     # 个别串口open可能阻塞, 不等待其结束
+            t.start()
+            threads.append(t)
+        deadline = time.time() + timeout
+        for t in threads:
+            t.join(max(deadline - time.time(), 0))
 
-        return self.get(model)
+        found = []
+        for port, hwid in candidates:
+            radio_id = results.get(port)
+            if radio_id and self.model_of(radio_id[1]):
+                found.append(self.__found(port, hwid, radio_id))
+        if found:
+            save_last_rig(found[0], self.cache_dir)
+        return found
+
+    def __found(self, port, hwid, radio_id):
+        return {
+            'HWID': hwid,
+            'PORT': port,
+            'BAUDRATE': radio_id[0],
+            'ID': radio_id[1],
+            'MODEL': self.model_of(radio_id[1]),
+            }
+
+    def auto_match(self, ports=None, timeout=1.0):
+        ''' 自动检测设备, 创建相应型号的类实例并连接, 未找到返回None '''
+        found = self.detect(ports, timeout=timeout)
+        if not found:
+            self.logger.error('no rig detected.')
+            return
+        rig = self.get(found[0]['MODEL'])
+        if rig is not None and rig.connect(found[0]['PORT'], found[0]['BAUDRATE']):
+            return rig
 
     # def get_ports(self):
     #     ''' 获取系统所有可用串口 '''
@@ -84,18 +646,76 @@ class RIG_CREATOR(object):
             radio_confs = self.__config_dict[model]['CONF']
             radio_class = self.__config_dict[model]['CLASS']
             
-            # 合并配置列表, 依次加载通用配置和个性化配置
-            config = self.merge_conf(radio_confs)   
-            assert config is not None, 'config interrupt or incomplete.'
-            assert self.check_conf(config), 'config check failed.'
+            # 优先读取编译缓存; 未命中时合并配置列表, 依次加载通用配置和个性化配置
+            config = self.load_cache(model, radio_confs)
+            if config is None:
+                config = self.merge_conf(radio_confs)   
+                assert config is not None, 'config interrupt or incomplete.'
+                assert self.check_conf(config), 'config check failed.'
+                self.save_cache(model, radio_confs, config)
+
+            # 预编译命令计划, 执行时不再解析配置
+            plans = compile_conf(config)
         except AssertionError, e:
             self.logger.error(e)
         except Exception, e:
             self.logger.error(e)
         else:
             self.logger.info('%s created, %d funcs.' % (model, len(config)))
-            return eval(radio_class)(model, config)
+            return eval(radio_class)(model, config, plans)
         
+    def __cache_path(self, model):
+        return os.path.join(self.cache_dir, re.sub(r'[^\w.-]', '_', model) + '.conf')
+
+    def load_cache(self, model, conf_list):
+        ''' 读取型号的编译配置缓存, 缓存不存在、版本不符或源文件变化时返回None '''
+        if self.cache_dir is None:
+            return
+        try:
+            with open(self.__cache_path(model), 'rb') as f:
+                cache = marshal.load(f)
+        except (IOError, EOFError, ValueError, TypeError):
+            return
+        if cache.get('VERSION') <> CONF_CACHE_VERSION:
+            return
+        signs = cache.get('SOURCES') or []
+        if [sign[0] for sign in signs] <> list(conf_list):
+            return
+        for sign in signs:
+            if not _sign_valid(sign):
+                self.logger.info('config changed: [%s]' % sign[0])
+                return
+        self.logger.info('load config cache: [%s]' % model)
+        return cache['CONF']
+
+    def save_cache(self, model, conf_list, config):
+        ''' 保存编译配置缓存, 先写临时文件再改名, 避免并发进程读到不完整文件 '''
+        if self.cache_dir is None:
+            return False
+        path = self.__cache_path(model)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError, e:
+                if e.errno <> errno.EEXIST:
+                    raise
+            cache = {
+                'VERSION': CONF_CACHE_VERSION,
+                'SOURCES': [_file_sign(p) for p in conf_list],
+                'CONF': config,
+                }
+            with open(tmp, 'wb') as f:
+                marshal.dump(cache, f)
+            os.rename(tmp, path)
+        except (IOError, OSError, ValueError), e:
+            # 缓存写入失败不影响使用, 下次重新解析
+            self.logger.warning('config cache save failed: %s' % e)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return False
+        return True
+
     def merge_conf(self, conf_list):
         '''
         调用 dict.update 将多个配置文件覆盖方式的合并.
@@ -107,9 +727,12 @@ class RIG_CREATOR(object):
             self.logger.info('load config: [%s]' % path)
             try:
                 with open(path,'r') as f:
-                    conf = yaml.load(f)
-                    assert conf is not None, 'empty config.'
-                    merged.update(conf)
+                    conf = yaml_load(f)
+                if conf is None:
+                    # 个性化配置可为空文件, 表示完全使用通用配置
+                    self.logger.info('empty config: [%s]' % path)
+                    continue
+                merged.update(conf)
             except Exception, e:
                 self.logger.error(e)
                 return
@@ -142,6 +765,7 @@ class RIG_CREATOR(object):
                 # ERR 0X: 函数名称检查
                 assert func_name.endswith('_GET') or func_name.endswith('_SET'), '[%s] ERR 01: not _GET or _SET type.' % func_name
                 assert func_conf is not None, '[%s] ERR 02: empty config.' % func_name
+                assert func_conf.get('PRIO', PRIO_INTERACTIVE) in PRIO_CLASSES, '[%s] ERR 03: PRIO not in %s' % (func_name, PRIO_CLASSES)
 
                 # ERR 1X: CMD 检查
                 assert func_conf.get('CMD') is not None, '[%s] ERR 11: no [CMD] part.' % func_name
@@ -155,6 +779,14 @@ class RIG_CREATOR(object):
                     # DIM 或 CONVERT 不可同时为空, 考虑是否需要为直接返回原始值设计(允许同时为空或设计特殊符号).
                     # assert func_conf.get('DIM') is not None or func_conf.get('CONVERT') is not None, '[%s] ERR 22: _GET - DIM and CONVERT both None.' % func_name
                     
+                    # 带参数的GET, 参数需在CONVERT中以EXPS/FORM格式配置
+                    for pa in re.finditer(r'\{\$(\w+)\}', func_conf.get('CMD')):
+                        assert isinstance((func_conf.get('CONVERT') or {}).get(pa.group(1)), dict), \
+                            '[%s] ERR 28: _GET - CMD vars need EXPS/FORM in [CONVERT]' % func_name
+
+                    if func_conf.get('TTL') is not None:
+                        assert isinstance(func_conf.get('TTL'), (int, float)) and func_conf.get('TTL') >= 0, '[%s] ERR 27: _GET - TTL not a number >= 0' % func_name
+
                     # 检查 RET 下的每个元素
                     for ret_name, ret_conf in func_conf.get('RET').iteritems():    
                         assert re.match(r'\d+,\d+', ret_conf), '[%s] ERR 23: _GET - RET interception syntax error' % func_name
@@ -190,12 +822,348 @@ class RIG_CREATOR(object):
         else:
             return True
 
+def byte_time(baudrate, bytesize=8, parity='N', stopbits=1):
+    ''' 串口传输单个字节所需时间(秒): 起始位 + 数据位 + 校验位 + 停止位 '''
+    bits = 1 + bytesize + (0 if parity == 'N' else 1) + stopbits
+    return float(bits) / baudrate
+
+class FRAME_READER(object):
+    # CAT响应分帧读取, 替代原先的忙等读取:
+    # 1. 串口读入的字节累积在缓冲区中, 按';'切分出完整帧(不含';')
+    # 2. 不完整的尾部字节, 以及已切分但未取走的帧, 保留给下一次读取
+    # 3. 每次读取都有截止时间, 等待依赖串口read()的超时(select), 不占用CPU
+    def __init__(self, conn, poll=0.05):
+        self.__conn = conn
+        self.__buf = ''
+        self.__frames = collections.deque()
+        self.poll = poll        # 串口为非阻塞模式(timeout=0/None)时的轮询间隔
+        self.tracer = None      # TRACE_WRITER, 记录读入的每一帧
+        self.metrics = None     # RIG_METRICS, 统计读入的字节数
+
+    def clear(self):
+        ''' 丢弃缓冲区中所有未取走的数据 '''
+        self.__buf = ''
+        self.__frames.clear()
+
+    def pending(self):
+        ''' 缓冲区中已切分出但未取走的帧数 '''
+        return len(self.__frames)
+
+    def feed(self, data):
+        ''' 追加读入的数据并切分帧 '''
+        if self.metrics is not None:
+            self.metrics.add_bytes(rx=len(data))
+        frames = (self.__buf + data).split(';')
+        self.__buf = frames.pop()
+        frames = [f for f in frames if f]
+        self.__frames.extend(frames)
+        if self.tracer is not None and frames:
+            self.tracer.record(TRACE_RX, frames)
+
+    def read_frame(self, timeout):
+        ''' 读取一个完整帧, 截止时间内未读到完整帧返回None '''
+        if self.__frames:
+            return self.__frames.popleft()
+
+        conn = self.__conn
+        deadline = time.time() + timeout
+        while True:
+            waiting = conn.in_waiting
+            if waiting or conn.timeout:
+                # 有数据时全部读出; 否则阻塞读1字节, 最长等待conn.timeout
+                data = conn.read(waiting or 1)
+            else:
+                data = ''
+            if data:
+                self.feed(data)
+                if self.__frames:
+                    return self.__frames.popleft()
+
+            remain = deadline - time.time()
+            if remain <= 0:
+                return
+            if not data and not conn.timeout:
+                time.sleep(min(remain, self.poll))
+
+def probe_id(port, bauds=PROBE_BAUDRATES, latency=0.1):
+    '''
+    以各波特率打开串口并发送ID;, 返回 (波特率, ID返回码), 均失败返回None.
+    每个波特率的等待时间为 latency + 收发字节时间. 先发';'结束设备缓冲区中的残余字节.
+    打开前置DTR/RTS为低, 避免以RTS控制PTT的接口误发射.
+    '''
+    for baudrate in bauds:
+        if not baudrate:
+            continue
+        conn = serial.Serial()
+        conn.port = port
+        conn.baudrate = baudrate
+        conn.timeout = 0.02
+        conn.write_timeout = 0.5
+        conn.dtr = False
+        conn.rts = False
+        try:
+            conn.open()
+        except (IOError, ValueError), e:    # serial.SerialException
+            return
+        try:
+            conn.reset_input_buffer()
+            conn.write(';ID;')
+            reader = FRAME_READER(conn)
+            deadline = time.time() + latency + 2 * 12 * byte_time(baudrate)
+            while True:
+                frame = reader.read_frame(max(deadline - time.time(), 0))
+                if frame is None:
+                    break
+                match = re.search(r'ID(\d{4})$', frame)
+                if match:
+                    return baudrate, match.group(1)
+        except (IOError, ValueError), e:
+            pass
+        finally:
+            conn.close()
+
+# 抓包文件格式:
+#   文件头: MAGIC(4s) VERSION(B) 开始时间(d, time.time()) 开始时钟(d, 记录时间戳所用时钟)
+#           型号长度(B) 型号
+#   记录:   时间戳(d) 方向(B, 0发送/1接收) 长度(H) 帧(不含;)
+# 一次写入多条命令时按帧拆分, 时间戳相同.
+TRACE_MAGIC = 'YCTR'
+TRACE_VERSION = 1
+TRACE_TX = 0
+TRACE_RX = 1
+TRACE_HEADER = struct.Struct('<4sBddB')
+TRACE_RECORD = struct.Struct('<dBH')
+# 时间戳优先使用单调时钟, python2无time.monotonic时退回time.time
+trace_clock = getattr(time, 'monotonic', time.time)
+
+class TRACE_WRITER(object):
+    # 串口收发抓包, 由YAESU_CAT.trace_start创建, 收发线程均可调用record
+    def __init__(self, path, model=''):
+        self.path = path
+        self.count = 0
+        self.__lock = threading.Lock()
+        self.__file = open(path, 'wb', 1 << 16)
+        self.__file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, time.time(),
+            trace_clock(), len(model)) + model)
+
+    def record(self, direction, frames):
+        ''' 记录一组帧, frames为帧列表或一次写入的原始命令串 '''
+        if isinstance(frames, basestring):
+            frames = [f for f in frames.split(';') if f]
+        ts = trace_clock()
+        data = ''.join(TRACE_RECORD.pack(ts, direction, len(f)) + f for f in frames)
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.write(data)
+                self.count += len(frames)
+
+    def close(self):
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+class CMD_BATCH(object):
+    # 一次写入的一组命令及其返回帧. 设备按命令顺序返回, 某帧匹配到第n个命令时,
+    # 之前仍未匹配的命令视为无返回; 错误码帧对应最早一个未返回的命令.
+    # 前缀为None的命令(SET)不等待返回.
+    def __init__(self, commands, prefixes, err_flag='?'):
+        self.commands = commands
+        self.prefixes = prefixes
+        self.err_flag = err_flag
+        self.frames = [None] * len(commands)
+        self.times = [None] * len(commands)     # 各返回帧的到达时间
+        self.pending = [i for i in range(len(commands)) if prefixes[i] is not None]
+        self.errors = []
+        self.done = threading.Event()
+        if not self.pending:
+            self.done.set()
+
+    def offer(self, frame):
+        ''' 尝试匹配一个返回帧, 被本批次接收返回True '''
+        pending = self.pending
+        if not pending:
+            return False
+        if frame == self.err_flag:
+            self.errors.append(pending.pop(0))
+        else:
+            for j, i in enumerate(pending):
+                if frame.startswith(self.prefixes[i]):
+                    self.frames[i] = frame
+                    self.times[i] = time.time()
+                    del pending[:j + 1]
+                    break
+            else:
+                return False
+        if not pending:
+            self.done.set()
+        return True
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0)    # 往返延迟直方图上界(秒)
+
+class RIG_METRICS(object):
+    # 收发统计: 各功能的调用/错误(?;)/超时次数和往返延迟直方图, 收发字节数, 链路占用率, 重连次数.
+    # 由YAESU_CAT.metrics_enable()创建, 每批命令加锁记录一次; 未开启时收发路径只多一次None判断.
+    def __init__(self, byte_time, model=''):
+        '''
+        byte_time: 返回当前单字节传输时间(秒)的函数, 用于计算链路占用率
+        '''
+        self.byte_time = byte_time
+        self.model = model
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            self.since = time.time()
+            self.tx_bytes = 0
+            self.rx_bytes = 0
+            self.connects = 0
+            self.reconnects = 0
+            self.__funcs = {}   # 功能名 -> [调用, 错误, 超时, 延迟和, 各区间计数]
+
+    def __func(self, name):
+        stats = self.__funcs.get(name)
+        if stats is None:
+            stats = self.__funcs[name] = [0, 0, 0, 0.0, [0] * (len(LATENCY_BUCKETS) + 1)]
+        return stats
+
+    def add_bytes(self, tx=0, rx=0):
+        ''' 记录写入/读入的字节数, 串口写入和读取(含AI后台线程)时调用 '''
+        with self.__lock:
+            self.tx_bytes += tx
+            self.rx_bytes += rx
+
+    def record_write(self, names):
+        ''' 记录只写入不等待返回的命令(SET) '''
+        with self.__lock:
+            for name in names:
+                self.__func(name)[0] += 1
+
+    def record_batch(self, names, batch, start, failed=False):
+        '''
+        记录一批命令的结果: 有返回帧的计延迟(写入到该帧到达), 错误码计错误, 未返回计超时.
+        failed: 串口异常, 全部计为错误
+        '''
+        errors = set(batch.errors)
+        with self.__lock:
+            for i, name in enumerate(names):
+                stats = self.__func(name)
+                stats[0] += 1
+                if failed or i in errors:
+                    stats[1] += 1
+                elif batch.times[i] is not None:
+                    latency = batch.times[i] - start
+                    stats[3] += latency
+                    stats[4][bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+                elif batch.prefixes[i] is not None:
+                    stats[2] += 1
+
+    def record_connect(self, reconnect):
+        with self.__lock:
+            self.connects += 1
+            if reconnect:
+                self.reconnects += 1
+
+    def snapshot(self):
+        '''
+        返回统计字典: TX_BYTES/RX_BYTES, TX_UTILIZATION/RX_UTILIZATION(占波特率容量的比例),
+        CONNECTS/RECONNECTS, FUNCS {功能名: {CALLS, ERRORS, TIMEOUTS, LATENCY_SUM, LATENCY_COUNT,
+        LATENCY_AVG, BUCKETS [(上界, 累计次数), ...]}}
+        '''
+        with self.__lock:
+            elapsed = max(time.time() - self.since, 1e-6)
+            capacity = elapsed / self.byte_time()   # 统计期间可传输的字节数
+            funcs = {}
+            for name, (calls, errors, timeouts, total, buckets) in self.__funcs.iteritems():
+                count, cumulative = 0, []
+                for bound, n in zip(LATENCY_BUCKETS + (float('inf'),), buckets):
+                    count += n
+                    cumulative.append((bound, count))
+                funcs[name] = {'CALLS': calls, 'ERRORS': errors, 'TIMEOUTS': timeouts,
+                    'LATENCY_SUM': total, 'LATENCY_COUNT': count,
+                    'LATENCY_AVG': total / count if count else None, 'BUCKETS': cumulative}
+            return {'MODEL': self.model, 'ELAPSED': elapsed,
+                'TX_BYTES': self.tx_bytes, 'RX_BYTES': self.rx_bytes,
+                'TX_UTILIZATION': self.tx_bytes / capacity, 'RX_UTILIZATION': self.rx_bytes / capacity,
+                'CONNECTS': self.connects, 'RECONNECTS': self.reconnects, 'FUNCS': funcs}
+
+    def prometheus(self, prefix='yaesu_cat'):
+        ''' 返回Prometheus文本格式的统计 '''
+        snap = self.snapshot()
+        model = 'model="%s"' % snap['MODEL']
+        lines = []
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP %s_%s %s' % (prefix, name, help_text))
+            lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+            for labels, value in samples:
+                lines.append('%s_%s{%s} %r' % (prefix, name, labels, value))
+
+        metric('tx_bytes_total', 'counter', 'Bytes written to the serial port.', [(model, snap['TX_BYTES'])])
+        metric('rx_bytes_total', 'counter', 'Bytes read from the serial port.', [(model, snap['RX_BYTES'])])
+        metric('link_utilization', 'gauge', 'Share of baud-rate capacity used since reset.',
+            [(model + ',direction="tx"', snap['TX_UTILIZATION']), (model + ',direction="rx"', snap['RX_UTILIZATION'])])
+        metric('reconnects_total', 'counter', 'Serial port reopened after a disconnect.', [(model, snap['RECONNECTS'])])
+
+        funcs = sorted(snap['FUNCS'].iteritems())
+        label = lambda name: '%s,func="%s"' % (model, name)
+        metric('calls_total', 'counter', 'Commands sent per function.',
+            [(label(name), f['CALLS']) for name, f in funcs])
+        metric('errors_total', 'counter', 'Error replies (?;) or serial errors per function.',
+            [(label(name), f['ERRORS']) for name, f in funcs])
+        metric('timeouts_total', 'counter', 'Replies not received before the deadline per function.',
+            [(label(name), f['TIMEOUTS']) for name, f in funcs])
+        lines.append('# HELP %s_latency_seconds Round-trip latency per function.' % prefix)
+        lines.append('# TYPE %s_latency_seconds histogram' % prefix)
+        for name, f in funcs:
+            if not f['LATENCY_COUNT']:
+                continue
+            for bound, count in f['BUCKETS']:
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('%s_latency_seconds_bucket{%s,le="%s"} %d' % (prefix, label(name), le, count))
+            lines.append('%s_latency_seconds_sum{%s} %r' % (prefix, label(name), f['LATENCY_SUM']))
+            lines.append('%s_latency_seconds_count{%s} %d' % (prefix, label(name), f['LATENCY_COUNT']))
+        return '\n'.join(lines) + '\n'
+
 class YAESU_CAT(object):
-    def __init__(self, model, config):
+    def __init__(self, model, config, plans=None):
         self.model = model
         self.__func_dict = config
+        self.__plans = plans if plans is not None else compile_conf(config)
         self.__conn = serial.Serial()
-        self.logger = Logger()
+        self.__reader = FRAME_READER(self.__conn)
+        self.__tracer = None
+        self.metrics = None         # RIG_METRICS, metrics_enable()开启
+        self.resp_latency = 0.2     # 设备处理命令的最大延迟(秒), 不含串口传输时间
+        self.__lock = threading.RLock()     # 串口收发互斥, AI模式下同时保护__waiters
+        # 串口占用按优先级调度(发射控制优先于后台轮询), 在__lock之外获取
+        self.__sched = PRIO_SCHEDULER(self.link_byte_time)
+        self.sched_quantum = 0.05   # 有更高优先级等待者时, 批量命令每次占用串口的最长传输时间(秒), 超出则分块
+
+        # AI(Auto Information)模式: 后台线程读取全部返回帧, 分发给等待中的命令批次,
+        # 其余主动上报帧按_GET配置解析, 更新状态缓存并产生变化事件
+        self.__ai_thread = None
+        self.__ai_on = False
+        self.__ai_callback = None
+        self.__ai_index = []
+        self.__waiters = []
+        self.__state = {}
+        self.__events = Queue.Queue(maxsize=1024)
+
+        # GET读缓存, 默认关闭: {功能名: (过期时间, 解析结果)}
+        self.__cache = None
+        self.__cache_ttl = 0
+        self.__cache_hit = 0
+        self.__cache_miss = 0
+
+        # 断线处理: 由CONNECTION_SUPERVISOR后台重连时, 调用方最多等待connect_wait秒(0为立即失败);
+        # 无监控时, 每reconnect_interval秒最多尝试一次重连, 期间的调用立即失败
+        self.supervisor = None
+        self.connect_wait = 0
+        self.reconnect_interval = 2.0
+        self.__last_connect = 0
+        self.__last_sets = collections.OrderedDict()    # 功能名 -> 最近一次成功的SET命令
+        self.logger = get_logger()
         self.logger.info('----- INIT: %s -----' % model)
 
     def __del__(self):
@@ -203,8 +1171,19 @@ class YAESU_CAT(object):
         if self.__conn.is_open:
             self.__conn.close()
     
-    def get_func(self):
+    def get_func(self, func_name=None):
+        ''' 返回命令配置的副本, 指定func_name时只复制该功能的配置(不存在返回None) '''
+        if func_name is not None:
+            return copy.deepcopy(self.__func_dict.get(func_name))
         return copy.deepcopy(self.__func_dict)
+
+    def func_names(self):
+        ''' 返回全部功能名(已排序), 不复制配置 '''
+        return sorted(self.__func_dict)
+
+    def get_plans(self):
+        ''' 返回编译后的命令计划 {功能名: CMD_PLAN}, 只读, 不要修改 '''
+        return self.__plans
     
     def get_model(self):
         return self.func_exec('ID_GET')
@@ -213,16 +1192,17 @@ class YAESU_CAT(object):
         ''' 返回连接状态 '''
         return self.__conn.is_open
 
-    def connect_auto(self):
-        # 尝试以不同速率连接所有串口, 尝试获取ID
-        # TODO: 1. 支持更多品牌和协议 
-        model_id = ''
-        for baudrate in (4800, 9600, 19200, 38400):
-            for p in serial.tools.list_ports.comports():
-                self.__conn = serial.Serial(p.device, baudrate)
-                model_id = self.get_model()
-                if model_id:
-                    return model_id
+    def connect_auto(self, ports=None, bauds=PROBE_BAUDRATES, timeout=1.0):
+        '''
+        并行探测所有串口(同RIG_CREATOR.detect), 连接第一个与本实例型号一致的设备,
+        返回ID返回码, 未找到返回None.
+        '''
+        for found in RIG_CREATOR().detect(ports, bauds, timeout):
+            if found['MODEL'] == self.model:
+                self.close(reset=True)
+                if self.connect(found['PORT'], found['BAUDRATE']):
+                    return found['ID']
+        self.logger.error('no %s detected.' % self.model)
         return
 
     def connect(
@@ -232,15 +1212,16 @@ class YAESU_CAT(object):
         ,bytesize=serial.EIGHTBITS
         ,parity=serial.PARITY_NONE
         ,stopbits=serial.STOPBITS_ONE
-        ,timeout=0          # 读超时
+        ,timeout=0.05       # 读超时
         ,write_timeout=1    # 写超时
         ):
         ''' 连接设备, open串口, 成功/失败返回True/False 
-        timeout: read()超时, None=等待直到返回, 0=无阻塞模式
+        timeout: read()单次等待上限, FRAME_READER在命令截止时间内按此粒度等待数据.
+                 None/0 时退化为按FRAME_READER.poll间隔轮询.
         '''
 
         if self.__conn.is_open:
-            self.logger.debug('already connected: %s@%s' % (port, baudrate))
+            self.logger.debug('already connected: %s@%s', port, baudrate)
             return True
         
         if self.__conn.port:
@@ -252,6 +1233,8 @@ class YAESU_CAT(object):
                 return False
             else:
                 self.logger.info('serial open successful.')
+                if self.metrics is not None:
+                    self.metrics.record_connect(True)
                 return True
         else:
             try:
@@ -272,76 +1255,399 @@ class YAESU_CAT(object):
                 self.logger.error(e)  
                 return False
             else:
-                self.logger.debug('serial connected: %s@%s' % (port, baudrate))
+                self.logger.debug('serial connected: %s@%s', port, baudrate)
+                if self.metrics is not None:
+                    self.metrics.record_connect(False)
                 return True
 
-    def cmd_rw_test(self, command):
+    def close(self, reset=False):
+        '''
+        关闭串口(AI模式同时关闭). reset=True时清除串口配置,
+        之后connect()按新的端口和波特率重新初始化, 否则connect()重新打开原串口.
+        可由其他线程(如CONNECTION_SUPERVISOR)调用: 占用串口调度和收发锁后再关闭, 不打断进行中的收发.
+        '''
+        with self.__sched.hold(PRIO_SAFETY):
+            self.ai_stop()
+            with self.__lock:
+                if self.__conn.is_open:
+                    self.__conn.close()
+                if reset:
+                    self.__conn.port = None
+
+    def link_byte_time(self):
+        ''' 当前串口配置下传输一个字节的时间(秒) '''
+        conn = self.__conn
+        return byte_time(conn.baudrate, conn.bytesize, conn.parity, conn.stopbits)
+
+    def cmd_timeout(self, command, reply_len=64):
+        '''
+        根据波特率和收发长度计算命令截止时间: 设备处理延迟 + 收发字节传输时间(留一倍余量)
+        '''
+        return self.resp_latency + 2 * (len(command) + reply_len) * self.link_byte_time()
+
+    def __write(self, data):
+        ''' 写入串口并等待发送完成, 抓包开启时记录发送帧 '''
+        self.__conn.write(data)
+        self.__conn.flush()
+        if self.metrics is not None:
+            self.metrics.add_bytes(tx=len(data))
+        if self.__tracer is not None:
+            self.__tracer.record(TRACE_TX, data)
+
+    def trace_start(self, path):
+        ''' 开始抓包, 记录此后串口收发的每一帧到path (见cat_trace.py) '''
+        self.trace_stop()
+        self.__tracer = TRACE_WRITER(path, self.model)
+        self.__reader.tracer = self.__tracer
+        self.logger.info('trace start: %s' % path)
+
+    def trace_stop(self):
+        ''' 停止抓包, 返回记录的帧数 '''
+        tracer, self.__tracer = self.__tracer, None
+        self.__reader.tracer = None
+        if tracer is None:
+            return 0
+        tracer.close()
+        self.logger.info('trace stop: %s, %d frames' % (tracer.path, tracer.count))
+        return tracer.count
+
+    def cmd_rw_test(self, command, timeout=0.5):
         ''' 发送命令并查看返回 '''
         self.__conn.reset_input_buffer()
-        self.__conn.write(command.encode('utf-8'))
-        self.__conn.flush()
+        self.__reader.clear()
+        self.__write(command.encode('utf-8'))
         print 'SEND: %s' % command
         
-        recv_str = ''
-        time.sleep(0.5)
-        if self.__conn.in_waiting:
-            recv_str = self.__conn.read(self.__conn.in_waiting).decode('utf-8')
-            recv_str = recv_str.split(';')[-2]
+        recv_str = self.__reader.read_frame(timeout)
+        if recv_str is not None:
             print 'RECV: %s' % recv_str
         else:
             print 'NO RECV'
 
-    def cmd_rw(self, command, debug=False, func_name=None, err_flag='?'):
+    def cmd_rw(self, command, debug=False, func_name=None, err_flag='?', timeout=None):
         ''' 
         GET命令, 返回是否执行成功(失败返回None), 可能的异常:
         串口未开启, 读取超时, 读到设备返回的指定错误码, 过程中发生异常
+        timeout: 截止时间(秒), 默认按波特率和预期返回长度计算
         '''
         # 是否DEBUG模式, 返回GET配置中的DEBUG数据
         if debug:
             assert func_name is not None, 'need <func_name> for debug mode: %s' % command
-            return self.__func_dict[func_name]['DEBUG']
+            return self.__plans[func_name].debug
+
+        plan = self.__plans.get(func_name)
+        if plan is not None:
+            prefix, prio, reply_len = plan.prefix, plan.prio, plan.ret_len + 1
+        else:
+            prefix, prio, reply_len = command[:2], PRIO_INTERACTIVE, 0
+        if timeout is None:
+            timeout = self.cmd_timeout(command, reply_len or 64)
+
+        return self.cmd_rw_many([command], [prefix], err_flag, timeout, prio, reply_len,
+            [func_name or command[:2]])[0]
+
+    def cmd_rw_many(self, commands, prefixes, err_flag='?', timeout=None,
+        prio=PRIO_INTERACTIVE, reply_len=0, names=None):
+        '''
+        批量GET命令: 一次写入全部命令, 按顺序读取返回帧并按前缀匹配到命令(CMD_BATCH).
+        返回与commands等长的列表, 未返回/返回错误码的位置为None.
+        prefixes中为None的命令(SET)只写入, 不等待返回.
+        AI模式下由后台线程读取并分发返回帧, 本函数只写入并等待.
+        prio, reply_len: 调度优先级及预计返回字节数(计入该优先级的链路预算)
+        names: 各命令的功能名, 用于收发统计, 默认取命令前两个字符
+        '''
+        return self.__rw_batch(commands, prefixes, err_flag, timeout, prio, reply_len, names)[0]
+
+    def __rw_batch(self, commands, prefixes, err_flag='?', timeout=None,
+        prio=PRIO_INTERACTIVE, reply_len=0, names=None):
+        ''' cmd_rw_many的实现, 返回 (返回帧列表, 是否串口异常), 串口异常时命令可能未写入 '''
+        batch = CMD_BATCH(commands, prefixes, err_flag)
+        command = ''.join(commands)
+        if timeout is None:
+            timeout = self.cmd_timeout(command, 0)
 
+        ai = False
+        failed = False
+        start = None
         try:
-            self.__conn.reset_input_buffer()
-            self.__conn.write(command.encode('utf-8'))
-            self.__conn.flush()
-            self.logger.debug('SEND: %s' % command.encode('utf-8'))
-            
-            recv_str = ''
-            while True:
-                if self.__conn.in_waiting:
-                    recv_str = self.__conn.read(self.__conn.in_waiting).decode('utf-8')
-                    break
+            with self.__sched.hold(prio, len(command) + reply_len), self.__lock:
+                if not self.__conn.is_open:
+                    raise serial.SerialException('port not open: %s' % self.__conn.port)
+                ai = self.__ai_on
+                if ai:
+                    self.__waiters.append(batch)
+                else:
+                    # 丢弃之前未取走的返回, 避免错配
+                    self.__conn.reset_input_buffer()
+                    self.__reader.clear()
+                start = time.time()
+                self.__write(command.encode('utf-8'))
+                self.logger.debug('SEND: %s', command)
 
-            # 若前一返回没被取走, 也没有被reset_input_buffer, 可能拿到xxx;xxx;的返回
-            recv_str = recv_str.split(';')[-2]
-            assert recv_str <> err_flag, 'error command result.'
-        except AssertionError, e:
-            self.logger.warning(e)
-            return
-        except IOError, e:      # serial.SerialException以及IDError合并
-            self.__conn.close()
+                if not ai:
+                    deadline = time.time() + timeout
+                    while batch.pending:
+                        recv_str = self.__reader.read_frame(max(deadline - time.time(), 0))
+                        if recv_str is None:
+                            break
+                        if not batch.offer(recv_str):
+                            self.logger.debug('DROP: %s', recv_str)
+
+            if ai:
+                batch.done.wait(timeout)
+        except (IOError, OSError, TypeError), e:    # serial.SerialException以及IDError合并, 串口被关闭或断开
+            failed = True
+            with self.__lock:
+                self.__conn.close()
             self.logger.error(e)
+        finally:
+            if ai:
+                with self.__lock:
+                    if batch in self.__waiters:
+                        self.__waiters.remove(batch)
+
+        metrics = self.metrics
+        if metrics is not None and start is not None:
+            metrics.record_batch(names or [c[:2] for c in commands], batch, start, failed)
+
+        for i in batch.errors:
+            self.logger.warning('error command result: %s' % commands[i])
+        if batch.pending:
+            self.logger.warning('read timeout: %s' % ''.join(commands[i] for i in batch.pending))
+        return batch.frames, failed
+
+    ############################ 读缓存 ############################
+
+    def cache_enable(self, default_ttl=0):
+        '''
+        开启GET读缓存. 各功能有效期取配置中的TTL(秒), 未配置时使用default_ttl,
+        有效期为0的功能(如仪表读数)不缓存. _SET执行成功后, 同名_GET及解析其写入字段的_GET缓存失效.
+        '''
+        if self.__cache is None:
+            self.__cache = {}
+        self.__cache_ttl = default_ttl
+
+    def cache_disable(self):
+        ''' 关闭并清空读缓存 '''
+        self.__cache = None
+
+    def cache_clear(self, func_name=None):
+        ''' 清空全部读缓存, 或指定功能的读缓存 '''
+        if self.__cache is None:
+            return
+        if func_name is None:
+            self.__cache.clear()
+        else:
+            self.__cache.pop(func_name.upper(), None)
+
+    def cache_stats(self):
+        ''' 读缓存统计: 命中/未命中次数, 当前缓存条目数 '''
+        return {
+            'HIT': self.__cache_hit,
+            'MISS': self.__cache_miss,
+            'SIZE': len(self.__cache) if self.__cache is not None else 0,
+            }
+
+    ############################ 收发统计 ############################
+
+    def metrics_enable(self):
+        ''' 开启收发统计(RIG_METRICS), 已开启时保留原统计, 返回统计对象 '''
+        if self.metrics is None:
+            self.metrics = RIG_METRICS(self.link_byte_time, self.model)
+            self.__reader.metrics = self.metrics
+        return self.metrics
+
+    def metrics_disable(self):
+        self.metrics = None
+        self.__reader.metrics = None
+
+    def metrics_stats(self):
+        ''' 收发统计字典(见RIG_METRICS.snapshot), 未开启返回None '''
+        if self.metrics is not None:
+            return self.metrics.snapshot()
+
+    def __cache_get(self, plan):
+        ''' 读取未过期的缓存, 不可缓存或未命中返回None '''
+        ttl = plan.ttl if plan.ttl is not None else self.__cache_ttl
+        if not ttl or plan.params:
+            return
+        entry = self.__cache.get(plan.name)
+        if entry is not None and entry[0] > time.time():
+            self.__cache_hit += 1
+            return dict(entry[1])
+        self.__cache_miss += 1
+
+    def __cache_invalidate(self, plan):
+        ''' SET执行后清除其写入字段相关的全部_GET缓存 '''
+        for name in plan.invalidates:
+            self.__cache.pop(name, None)
+
+    def __cache_put(self, plan, cmd_ret):
+        ttl = plan.ttl if plan.ttl is not None else self.__cache_ttl
+        if ttl and not plan.params:
+            self.__cache[plan.name] = (time.time() + ttl, dict(cmd_ret))
+
+    ############################ AI模式 ############################
+
+    def ai_start(self, callback=None, prime=None):
+        '''
+        开启AI(Auto Information)模式, 成功返回True:
+        1. 发送AI1; 设备此后主动上报状态变化(FA..;, MD0..;, IF..;等)
+        2. 后台线程读取所有帧, 按命令前缀匹配_GET配置解析, 更新状态缓存
+        3. 状态变化时调用 callback(功能名, 新值, 旧值), 并放入ai_events事件队列
+        prime: 开启后先批量读取一次的_GET功能列表, 用于填充初始状态
+        '''
+        if self.__ai_on:
+            return True
+        if not self.__conn.is_open and not self.connect():
+            return False
+
+        # 无参数的_GET按前缀长度倒序, 解析时优先匹配最长前缀
+        self.__ai_index = sorted(
+            (plan for plan in self.__plans.itervalues() if plan.is_get and len(plan.parts) == 1),
+            key=lambda plan: len(plan.prefix), reverse=True)
+        self.__ai_callback = callback
+
+        with self.__sched.hold(), self.__lock:
+            try:
+                self.__conn.reset_input_buffer()
+                self.__reader.clear()
+                self.__write('AI1;')
+            except IOError, e:
+                self.__conn.close()
+                self.logger.error(e)
+                return False
+            self.__ai_on = True
+            self.__ai_thread = threading.Thread(target=self.__ai_loop, name='AI-%s' % self.model)
+            self.__ai_thread.daemon = True
+            self.__ai_thread.start()
+        self.logger.info('AI mode on.')
+
+        if prime:
+            self.func_exec_many(prime)
+        return True
+
+    def ai_stop(self):
+        ''' 关闭AI模式, 发送AI0; 并结束后台线程 '''
+        if not self.__ai_on:
             return
+        # 在串口调度占用期间关闭并等待后台线程结束, 其间前台命令不能进入直接读取.
+        # join时不持有__lock, 后台线程分发返回帧需要获取__lock.
+        with self.__sched.hold():
+            # 已写入命令的等待者仍由后台线程分发返回帧, 最多等待1秒
+            deadline = time.time() + 1.0
+            for batch in list(self.__waiters):
+                batch.done.wait(max(deadline - time.time(), 0))
+            try:
+                with self.__lock:
+                    self.__ai_on = False
+                    self.__write('AI0;')
+            except IOError, e:
+                self.logger.error(e)
+            if self.__ai_thread is not threading.current_thread():
+                self.__ai_thread.join()
+            self.__ai_thread = None
+        self.logger.info('AI mode off.')
+
+    def ai_status(self):
+        ''' AI模式是否开启 '''
+        return self.__ai_on
+
+    def ai_get(self, func_name=None):
+        ''' 读取状态缓存, 不访问串口. 不指定功能名时返回全部状态 {功能名: 解析结果} '''
+        if func_name is None:
+            return dict((k, dict(v)) for k, v in self.__state.items())
+        ret = self.__state.get(func_name.upper())
+        return dict(ret) if ret is not None else None
+
+    def ai_events(self, timeout=None):
+        '''
+        迭代状态变化事件 (功能名, 新值, 旧值).
+        timeout秒内无新事件, 或AI模式关闭且事件已取完时结束迭代.
+        '''
+        idle = 0
+        while self.__ai_on or not self.__events.empty():
+            try:
+                yield self.__events.get(timeout=0.5)
+                idle = 0
+            except Queue.Empty:
+                idle += 0.5
+                if timeout is not None and idle >= timeout:
+                    return
+
+    def __ai_loop(self):
+        while self.__ai_on:
+            try:
+                frame = self.__reader.read_frame(0.5)
+            except (IOError, OSError, TypeError), e:    # 串口被关闭或断开
+                self.logger.error('AI reader stopped: %s' % e)
+                self.__conn.close()
+                self.__ai_on = False
+                break
+            if frame is not None:
+                self.__ai_dispatch(frame)
+
+    def __ai_dispatch(self, frame):
+        ''' 返回帧先交给等待中的命令批次, 再按_GET配置解析并更新状态缓存 '''
+        with self.__lock:
+            for batch in self.__waiters:
+                if batch.offer(frame):
+                    if batch.done.is_set():
+                        self.__waiters.remove(batch)
+                    break
+
+        for plan in self.__ai_index:
+            if frame.startswith(plan.prefix) and len(frame) >= plan.ret_len:
+                break
         else:
-            return recv_str     # ';'可省略
+            self.logger.debug('AI unknown: %s', frame)
+            return
+
+        try:
+            new = plan.decode(frame)
+        except ValueError, e:
+            self.logger.warning('AI decode error: %s - %s' % (plan.name, frame))
+            return
+        if self.__cache is not None:
+            self.__cache_put(plan, new)
+        old = self.__state.get(plan.name)
+        if new == old:
+            return
+        self.__state[plan.name] = new
+        self.logger.debug('AI [%s] %s >> %s', plan.name, frame, new)
+
+        event = (plan.name, new, old)
+        try:
+            self.__events.put_nowait(event)
+        except Queue.Full:      # 无人消费时丢弃最早的事件
+            self.__events.get_nowait()
+            self.__events.put_nowait(event)
+        if self.__ai_callback is not None:
+            try:
+                self.__ai_callback(*event)
+            except Exception, e:
+                self.logger.error('AI callback error: %s' % e)
 
-    def cmd_w(self, command, debug=False):
+    def cmd_w(self, command, debug=False, prio=PRIO_INTERACTIVE, func_name=None):
         ''' 
         SET命令, 返回是否执行成功(失败返回None), 可能的异常:
         串口未开启, 写入超时, 写入时发生异常. write命令被write_timeoout配置.
+        prio: 调度优先级, 与GET命令共用串口调度
+        func_name: 功能名, 用于收发统计, 默认取命令前两个字符
         '''
         
         # DEBUG 模式, 只打日志不执行.
         if debug:
-            self.logger.debug('[DEBUG]: %s' % command)
+            self.logger.debug('[DEBUG]: %s', command)
             return len(command)
 
         try:
             # 发送命令后, 将缓冲区全部写入清空
-            self.__conn.write(command.encode('utf-8'))
-            self.__conn.flush()
-            self.logger.debug('SEND: %s' % command.encode('utf-8'))
+            with self.__sched.hold(prio, len(command)), self.__lock:
+                self.__write(command.encode('utf-8'))
+            self.logger.debug('SEND: %s', command)
+            if self.metrics is not None:
+                self.metrics.record_write([func_name or command[:2]])
         except serial.SerialException, e:
             self.__conn.close()
             self.logger.error('serial error when write: %s' % command)
@@ -360,89 +1666,278 @@ class YAESU_CAT(object):
         4. 本函数所有异常情况, 均返回None, 由调用方进行识别处理.
         '''
         
-        # 非DEBUG模式下, 若串口未打开, 尝试一次打开, 成功则继续, 否则返回报错.
-        if not debug and not self.__conn.is_open:
-            time.sleep(2)       # 避免频繁尝试重连
-            if not self.connect():
+        func_name = func_name.upper()
+        if not skip_check:
+            func_name = self.__resolve(func_name)
+            if func_name is None:
                 return
 
-        func_name = func_name.upper()
+        plan = self.__plans.get(func_name)
+        if plan is None:
+            self.logger.error('FUNC_EXEC unknown: %s' % func_name)
+            return
 
-        func_name_pass = False
-        if not skip_check:
-            # 支持不完整命令, 若XX+'_GET'/XX+'_SET'仅有一个, 可省略, 否则返回报错
-            if not func_name.endswith('_GET') and not func_name.endswith('_SET'):
-                try_get = self.__func_dict.has_key(func_name+'_GET')
-                try_set = self.__func_dict.has_key(func_name+'_SET')
-                if try_get and try_set:
-                    self.logger.error('ambigious func: %s' % func_name)
-                    return
-                elif try_get or try_set:
-                    func_name_pass = True   # 避免补全后重复检查has_key
-                    func_name = func_name + '_GET' if try_get else func_name + '_SET'
-                else:
-                    self.logger.error('unknown func: %s' % func_name)
-                    return
+        # 读缓存命中时直接返回, 不访问串口
+        cache = self.__cache is not None and not debug
+        if cache and plan.is_get:
+            cmd_ret = self.__cache_get(plan)
+            if cmd_ret is not None:
+                return cmd_ret
 
-        self.logger.debug('FUNC_EXEC: %s' % func_name)
-
-        if func_name_pass or skip_check or self.__func_dict.has_key(func_name):
-            if func_name.endswith('_GET'):
-                # _GET类: 按READ方式(先发后收)执行命令CMD, 将返回结果按照转换配置完成转换
-                cmd_ret = {}
-                ret = self.cmd_rw(self.__func_dict[func_name]['CMD'], debug, func_name)
-                if ret:
-                    for k,v in self.__func_dict[func_name]['RET'].iteritems():
-                        # 按照RET部分配置, 截取结果, 对每个参数, 按顺序尝试: DIM(转码), CONVERT(值转换, 整型)或直接返回
-                        ret_seg = ret[eval(v)[0]:eval(v)[1]]
-
-                        if self.__func_dict[func_name].get('DIM') is not None and self.__func_dict[func_name].get('DIM').get(k) is not None:
-                            cmd_ret[k] = self.__func_dict[func_name]['DIM'][k].get(ret_seg, 'UNKNOWN')
-                        elif self.__func_dict[func_name].get('CONVERT') is not None and self.__func_dict[func_name].get('CONVERT').get(k) is not None:
-                            # 目前值转换格式只允许转换为整型, 用于数值类返回
-                            cmd_ret[k] = int(round(eval(self.__func_dict[func_name]['CONVERT'][k].replace('x', str(int(ret_seg))))))
-                        else:
-                            cmd_ret[k] = ret_seg
-
-                        self.logger.debug('[%s: %s] >> [%s:%s]' % (func_name, k, ret_seg, str(cmd_ret[k])))
-                    return cmd_ret
-                else:
-                    self.logger.error('FUNC_EXEC_GET return error: %s' % (func_name))
-            elif func_name.endswith('_SET'):
-                command = self.__func_dict[func_name]['CMD']
-                for k,v in kwargs.iteritems():  
-                    # 将函数入参转换格式后进行替换, 按顺序尝试: DIM(转码), CONVERT(值转换)或直接替换
-                    if self.__func_dict[func_name].get('DIM') is not None and self.__func_dict[func_name]['DIM'].get(k) is not None:
-                        arg_code = self.__func_dict[func_name]['DIM'][k].get(v)
-                        assert  arg_code is not None and not arg_code.strip().isspace(), 'no [%s] in DIM: %s - %s' % (v, func_name, k)
-                        command = command.replace('{$'+k+'}', arg_code)
-                    elif self.__func_dict[func_name].get('CONVERT') is not None and self.__func_dict[func_name]['CONVERT'].get(k) is not None:
-                        assert self.__func_dict[func_name]['CONVERT'][k].get('EXPS') is not None \
-                            and self.__func_dict[func_name]['CONVERT'][k].get('FORM') is not None, 'func [%s] CONVERT with invalid config.' % func_name
-
-                        conv_val = int(round(eval(self.__func_dict[func_name]['CONVERT'][k]['EXPS'].replace('x', str(v)))))
-                        form = self.__func_dict[func_name]['CONVERT'][k]['FORM'].split('|')
-
-                        if form[0] == 'L':
-                            var_str = str(conv_val).ljust(int(form[1]), form[2])
-                        elif form[0] == 'R':
-                            var_str = str(conv_val).rjust(int(form[1]), form[2])
-                        else:   # 若FORM无法识别, 则默认将转换后的数值作为字符串直接使用
-                            var_str = str(conv_val)
-                        command = command.replace('{$%s}' % k, var_str)
-                    else:
-                        command = command.replace('{$%s}' % k, str(v))
-                
-                # 检查是否有未替换的参数
+        # 非DEBUG模式下, 若串口未打开, 按断线处理规则等待或重连, 失败则返回报错.
+        if not debug and not self.ensure_open():
+            return
+
+        self.logger.debug('FUNC_EXEC: %s', func_name)
+
+        if plan.is_get:
+            # _GET类: 按READ方式(先发后收)执行命令CMD, 将返回结果按照转换配置完成转换
+            command = plan.cmd
+            if plan.params:
+                # 带参数的_GET(如MR{$CHANNEL};), 按前缀匹配返回
+                command = plan.encode(kwargs)
                 if not skip_check:
                     assert command.find('{$') < 0, 'some vars not been replaced: %s' % command
+            ret = self.cmd_rw(command, debug, func_name)
+            if ret:
+                try:
+                    cmd_ret = plan.decode(ret)
+                except ValueError, e:
+                    self.logger.error('FUNC_EXEC_GET decode error: %s - %s' % (func_name, ret))
+                    return
+                self.logger.debug('[%s] %s >> %s', func_name, ret, cmd_ret)
+                if cache:
+                    self.__cache_put(plan, cmd_ret)
+                return cmd_ret
+            else:
+                self.logger.error('FUNC_EXEC_GET return error: %s' % (func_name))
+        else:
+            # _SET类: 将函数入参转换格式后替换CMD中的参数
+            command = plan.encode(kwargs)
+
+            # 检查是否有未替换的参数
+            if not skip_check:
+                assert command.find('{$') < 0, 'some vars not been replaced: %s' % command
+
+            ret = self.cmd_w(command, debug, plan.prio, plan.name)
+            if ret and not debug:
+                self.__remember_set(plan, command)
+            if cache and ret:
+                self.__cache_invalidate(plan)
+            return ret
 
-                return self.cmd_w(command, debug)
+        return
+
+    def func_exec_many(self, func_names, debug=False):
+        '''
+        批量执行_GET功能, 所有命令一次写入, 一次往返读取全部返回.
+        返回 {功能名: 解析结果}, 单个功能失败时结果为None, 连接失败返回None.
+        功能名补全规则与func_exec相同, 重复的功能只执行一次.
+        '''
+        cmd_ret = {}
+        plans = []
+        cache = self.__cache is not None and not debug
+        for func_name in func_names:
+            func_name = self.__resolve(func_name.upper())
+            if func_name is None or cmd_ret.has_key(func_name):
+                continue
+            cmd_ret[func_name] = None
+            plan = self.__plans.get(func_name)
+            if plan is None:
+                self.logger.error('FUNC_EXEC unknown: %s' % func_name)
+            elif not plan.is_get or plan.params:
+                self.logger.error('FUNC_EXEC_MANY not a _GET without vars: %s' % func_name)
             else:
-                self.logger.error('FUNC_EXEC not a _SET or _GET: %s' % func_name)
+                cmd_ret[func_name] = self.__cache_get(plan) if cache else None
+                if cmd_ret[func_name] is None:
+                    plans.append(plan)
+
+        if not plans:
+            return cmd_ret
+
+        if not debug and not self.ensure_open():
+            return
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('FUNC_EXEC_MANY: %s', ','.join(plan.name for plan in plans))
+
+        if debug:
+            frames = [plan.debug for plan in plans]
         else:
-            self.logger.error('FUNC_EXEC unknown: %s' % func_name)
-        
+            # 无更高优先级等待者时一次写入; 否则分块执行, 每块占用串口不超过sched_quantum, 块间可被插入
+            frames = []
+            for chunk in self.__chunks(plans):
+                commands = [plan.cmd for plan in chunk]
+                reply_len = sum(plan.ret_len + 1 for plan in chunk)
+                frames.extend(self.cmd_rw_many(commands, [plan.prefix for plan in chunk],
+                    timeout=self.cmd_timeout(''.join(commands), reply_len),
+                    prio=min(plan.prio for plan in chunk), reply_len=reply_len,
+                    names=[plan.name for plan in chunk]))
+
+        for plan, ret in zip(plans, frames):
+            if not ret:
+                self.logger.error('FUNC_EXEC_GET return error: %s' % plan.name)
+                continue
+            try:
+                cmd_ret[plan.name] = plan.decode(ret)
+            except ValueError, e:
+                self.logger.error('FUNC_EXEC_GET decode error: %s - %s' % (plan.name, ret))
+                continue
+            if cache:
+                self.__cache_put(plan, cmd_ret[plan.name])
+        return cmd_ret
+
+    def func_exec_seq(self, items, debug=False):
+        '''
+        按顺序执行一组_SET和_GET功能, 所有命令一次写入, 一次往返读取全部返回.
+        items中每项为功能名(_GET), 或 (功能名, kwargs) (_SET或_GET).
+        返回与items等长的列表: _GET为解析结果, _SET为True; 失败的_GET为None.
+        参数错误, 连接失败或写入失败(_SET可能未发送)返回None. 不读缓存, _SET执行后清除对应的读缓存.
+        注意: 设备对_SET返回错误码时, 该错误对应到其后最早一个_GET.
+        '''
+        plans = []
+        commands = []
+        for item in items:
+            func_name, kwargs = (item, {}) if isinstance(item, basestring) else item
+            func_name = self.__resolve(func_name.upper())
+            plan = self.__plans.get(func_name) if func_name else None
+            if plan is None:
+                self.logger.error('FUNC_EXEC unknown: %s' % func_name)
+                return
+            command = plan.encode(kwargs) if kwargs or not plan.is_get else plan.cmd
+            if command.find('{$') >= 0:
+                self.logger.error('FUNC_EXEC_SEQ vars not been replaced: %s' % command)
+                return
+            plans.append(plan)
+            commands.append(command)
+
+        if not debug and not self.ensure_open():
+            return
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('FUNC_EXEC_SEQ: %s', ''.join(commands))
+
+        if debug:
+            frames = [plan.debug if plan.is_get else None for plan in plans]
+        else:
+            prefixes = [plan.prefix if plan.is_get else None for plan in plans]
+            reply_len = sum(plan.ret_len + 1 for plan in plans if plan.is_get)
+            frames, failed = self.__rw_batch(commands, prefixes,
+                timeout=self.cmd_timeout(''.join(commands), reply_len),
+                prio=min(plan.prio for plan in plans), reply_len=reply_len,
+                names=[plan.name for plan in plans])
+            if failed:
+                # 写入失败时_SET可能未发送, 整组按失败处理
+                self.logger.error('FUNC_EXEC_SEQ write error: %s' % ''.join(commands))
+                return
+
+        cmd_ret = []
+        for plan, command, ret in zip(plans, commands, frames):
+            if not plan.is_get:
+                if not debug:
+                    self.__remember_set(plan, command)
+                if self.__cache is not None:
+                    self.__cache_invalidate(plan)
+                cmd_ret.append(True)
+            elif not ret:
+                self.logger.error('FUNC_EXEC_GET return error: %s' % plan.name)
+                cmd_ret.append(None)
+            else:
+                try:
+                    cmd_ret.append(plan.decode(ret))
+                except ValueError, e:
+                    self.logger.error('FUNC_EXEC_GET decode error: %s - %s' % (plan.name, ret))
+                    cmd_ret.append(None)
+        return cmd_ret
+
+    def ensure_open(self):
+        '''
+        确认串口已打开. 未打开时: 有连接监控则等待其重连, 最多connect_wait秒;
+        否则距上次尝试超过reconnect_interval秒时立即尝试重连一次. 不在调用方线程中休眠.
+        '''
+        if self.__conn.is_open:
+            return True
+        if self.supervisor is not None:
+            return self.connect_wait > 0 and self.supervisor.wait_connected(self.connect_wait)
+        now = time.time()
+        if now - self.__last_connect < self.reconnect_interval:
+            return False
+        self.__last_connect = now
+        return self.connect()
+
+    def write_set(self, plan, command):
+        '''
+        写入已编码的SET命令(如SET_COALESCER提交时已编码), 不再查找功能和编码参数.
+        与func_exec相同: 记录为最近的SET, 清除对应的读缓存. 返回是否写入成功.
+        '''
+        if not self.ensure_open():
+            return
+        ret = self.cmd_w(command, prio=plan.prio, func_name=plan.name)
+        if ret:
+            self.__remember_set(plan, command)
+            if self.__cache is not None:
+                self.__cache_invalidate(plan)
+        return ret
+
+    def __remember_set(self, plan, command):
+        self.__last_sets.pop(plan.name, None)
+        self.__last_sets[plan.name] = (plan, command)
+
+    def last_sets(self):
+        ''' 最近成功执行的SET命令 {功能名: 命令}, 按执行顺序 '''
+        return collections.OrderedDict((k, v[1]) for k, v in self.__last_sets.items())
+
+    def replay_sets(self, func_names=None):
+        '''
+        按原执行顺序重新发送最近的SET命令(重连后恢复设置), 返回发送成功的数量.
+        func_names: 只重发指定功能, 默认全部
+        '''
+        count = 0
+        for name, (plan, command) in self.__last_sets.items():
+            if func_names is not None and name not in func_names:
+                continue
+            if self.cmd_w(command, prio=plan.prio, func_name=name):
+                count += 1
+        return count
+
+    def __chunks(self, plans):
+        '''
+        将GET计划分块: 每块前检查调度器, 无更高优先级的等待者时剩余计划作为一块一次写入,
+        否则按sched_quantum内可传输的字节数(命令+返回)分块
+        '''
+        limit = self.sched_quantum / self.link_byte_time()
+        i, count = 0, len(plans)
+        while i < count:
+            if not self.__sched.urgent(min(plan.prio for plan in plans[i:])):
+                yield plans[i:]
+                return
+            chunk, size = [], 0
+            while i < count:
+                nbytes = len(plans[i].cmd) + plans[i].ret_len + 1
+                if chunk and size + nbytes > limit:
+                    break
+                chunk.append(plans[i])
+                size += nbytes
+                i += 1
+            yield chunk
+
+    def sched_status(self):
+        ''' 串口调度状态: 各优先级的等待数和获得占用的次数 '''
+        return {'WAITING': self.__sched.waiting(), 'GRANTED': dict(self.__sched.granted)}
+
+    def __resolve(self, func_name):
+        '''
+        补全功能名称, 若XX+'_GET'/XX+'_SET'仅有一个, 可省略后缀, 否则返回None
+        '''
+        if func_name.endswith('_GET') or func_name.endswith('_SET'):
+            return func_name
+
+        try_get = self.__plans.has_key(func_name+'_GET')
+        try_set = self.__plans.has_key(func_name+'_SET')
+        if try_get and try_set:
+            self.logger.error('ambigious func: %s' % func_name)
+        elif try_get or try_set:
+            return func_name + '_GET' if try_get else func_name + '_SET'
+        else:
+            self.logger.error('unknown func: %s' % func_name)
         return
     
     ############################ 增益值 ############################
@@ -554,6 +2049,380 @@ class YAESU_CAT(object):
             'MODE': mode_list[ret[21:22]]
             }
 
+class CMD_TIMEOUT(Exception):
+    # CMD_FUTURE.result()在timeout内未完成
+    pass
+
+class CMD_FUTURE(object):
+    # 异步命令的执行结果, 由ASYNC_YAESU_CAT的工作线程设置.
+    # 状态: PENDING(排队) -> RUNNING(已发送) -> FINISHED, 或 PENDING -> CANCELLED
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__done = threading.Event()
+        self.__state = 'PENDING'
+        self.started = None     # 开始执行/完成的时间戳, 用于统计执行耗时
+        self.finished = None
+        self.__result = None
+        self.__exception = None
+        self.__callbacks = []
+
+    def cancel(self):
+        ''' 取消排队中的命令, 已发送的命令不可取消(保证收发帧不错位) '''
+        with self.__lock:
+            if self.__state <> 'PENDING':
+                return self.__state == 'CANCELLED'
+            self.__state = 'CANCELLED'
+        self.__finish()
+        return True
+
+    def cancelled(self):
+        return self.__state == 'CANCELLED'
+
+    def done(self):
+        return self.__done.is_set()
+
+    def wait(self, timeout=None):
+        ''' 等待完成, 返回是否已完成 '''
+        return self.__done.wait(timeout)
+
+    def result(self, timeout=None):
+        '''
+        等待并返回结果. timeout内未完成抛出CMD_TIMEOUT, 已取消返回None,
+        执行中的异常在此抛出. 命令失败时结果为None(与同步调用相同).
+        '''
+        if not self.__done.wait(timeout):
+            raise CMD_TIMEOUT('command not finished in %ss' % timeout)
+        if self.__exception is not None:
+            raise self.__exception
+        return self.__result
+
+    def add_done_callback(self, fn):
+        ''' 完成(含取消)后调用 fn(future), 已完成则立即调用 '''
+        with self.__lock:
+            if not self.__done.is_set():
+                self.__callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_running(self):
+        ''' 工作线程开始执行前调用, 已取消返回False '''
+        with self.__lock:
+            if self.__state <> 'PENDING':
+                return False
+            self.__state = 'RUNNING'
+            self.started = time.time()
+            return True
+
+    def set_result(self, result, exception=None):
+        with self.__lock:
+            self.__state = 'FINISHED'
+            self.finished = time.time()
+            self.__result = result
+            self.__exception = exception
+        self.__finish()
+
+    def __finish(self):
+        self.__done.set()
+        with self.__lock:
+            callbacks, self.__callbacks = self.__callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception, e:
+                get_logger().error('CMD_FUTURE callback error: %s' % e)
+
+class ASYNC_YAESU_CAT(object):
+    # 非阻塞调用封装: 单个工作线程独占YAESU_CAT实例, 所有调用方的命令进入队列,
+    # 由工作线程严格串行发送, 调用方立即得到CMD_FUTURE, 可等待或注册回调.
+    # 本模块基于python2, 无asyncio, 事件循环可通过add_done_callback接入结果.
+    def __init__(self, rig, maxsize=0):
+        self.rig = rig
+        self.__queue = Queue.Queue(maxsize)
+        self.__thread = threading.Thread(target=self.__loop, name='CAT-%s' % rig.model)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def submit(self, method, args=(), kwargs=None, timeout=None):
+        '''
+        提交对rig的方法调用, 返回CMD_FUTURE.
+        timeout: 自提交起的截止时间(秒), 排队超过截止时间的命令不再发送, 结果为None
+        '''
+        future = CMD_FUTURE()
+        deadline = time.time() + timeout if timeout is not None else None
+        self.__queue.put((future, method, args, kwargs or {}, deadline))
+        return future
+
+    def func_exec(self, func_name, debug=False, timeout=None, **kwargs):
+        ''' 同YAESU_CAT.func_exec, 返回CMD_FUTURE '''
+        kwargs['debug'] = debug
+        return self.submit('func_exec', (func_name,), kwargs, timeout)
+
+    def func_exec_many(self, func_names, debug=False, timeout=None):
+        ''' 同YAESU_CAT.func_exec_many, 返回CMD_FUTURE '''
+        return self.submit('func_exec_many', (func_names,), {'debug': debug}, timeout)
+
+    def qsize(self):
+        ''' 排队中的命令数 '''
+        return self.__queue.qsize()
+
+    def close(self, timeout=None):
+        ''' 执行完已排队的命令后结束工作线程 '''
+        self.__queue.put(None)
+        self.__thread.join(timeout)
+
+    def __loop(self):
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                break
+            future, method, args, kwargs, deadline = item
+            if deadline is not None and time.time() > deadline:
+                if future.set_running():
+                    self.rig.logger.warning('queue timeout: %s%s' % (method, args))
+                    future.set_result(None)
+                continue
+            if not future.set_running():
+                continue    # 已取消
+            # 断线时在截止时间内等待连接监控重连, 未设置截止时间则立即执行(快速失败)
+            supervisor = self.rig.supervisor
+            if supervisor is not None and deadline is not None and not self.rig.connect_status():
+                supervisor.wait_connected(max(deadline - time.time(), 0))
+            try:
+                future.set_result(getattr(self.rig, method)(*args, **kwargs))
+            except Exception, e:
+                future.set_result(None, e)
+
+class SET_COALESCER(object):
+    # 旋钮类连续SET的合并写入(如VFO_A_FREQ_SET, AF_GAIN_SET, CLAR_SET):
+    # 1. 每个功能一个待发送槽, 未发送的旧值被新值覆盖, 不发送过期的中间值
+    # 2. 后台线程直接写入提交时编码好的命令, 两次写入的开始时间至少间隔前一条的字节传输时间
+    #    (及min_interval), 串口不积压, 等待期间到达的新值在槽中合并
+    # 3. barrier()等待此前提交的全部值写入, 用于需要保证顺序的场合
+    def __init__(self, rig, min_interval=0.0):
+        '''
+        rig: YAESU_CAT实例
+        min_interval: 两次写入的最小间隔(秒), 设备处理较慢时可加大
+        '''
+        self.rig = rig
+        self.min_interval = min_interval
+        self.submitted = 0      # 提交次数
+        self.sent = 0           # 实际写入次数
+        self.__plans = rig.get_plans()
+        self.__slots = collections.OrderedDict()    # 功能名 -> (CMD_PLAN, 命令)
+        self.__busy = False     # 是否正在写入
+        self.__next_send = 0    # 下一次写入的最早开始时间
+        self.__cond = threading.Condition()
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__loop, name='SET-%s' % rig.model)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def submit(self, func_name, **kwargs):
+        '''
+        提交_SET功能, 立即编码并放入该功能的槽, 覆盖未发送的旧值. 参数错误返回None.
+        功能名可省略_SET后缀.
+        '''
+        func_name = func_name.upper()
+        if not func_name.endswith('_SET'):
+            func_name += '_SET'
+        plan = self.__plans.get(func_name)
+        if plan is None or plan.is_get:
+            self.rig.logger.error('SET_COALESCER unknown: %s' % func_name)
+            return
+        command = plan.encode(kwargs)
+        if command.find('{$') >= 0:
+            self.rig.logger.error('SET_COALESCER vars not been replaced: %s' % command)
+            return
+        with self.__cond:
+            # 覆盖时保留原位置, 持续转动的旋钮不会被其他功能挤到队尾
+            self.__slots[func_name] = (plan, command)
+            self.submitted += 1
+            self.__cond.notify_all()
+        return True
+
+    def pending(self):
+        ''' 待发送的功能数 '''
+        with self.__cond:
+            return len(self.__slots)
+
+    def coalesced(self):
+        ''' 被覆盖未发送的值的数量 '''
+        with self.__cond:
+            return self.submitted - self.sent - len(self.__slots)
+
+    def barrier(self, timeout=None):
+        ''' 等待此前提交的值全部写入, 超时返回False '''
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.__cond:
+            while self.__slots or self.__busy:
+                if deadline is None:
+                    self.__cond.wait()
+                else:
+                    remain = deadline - time.time()
+                    if remain <= 0:
+                        return False
+                    self.__cond.wait(remain)
+            return True
+
+    def close(self, timeout=None):
+        ''' 写完待发送的值后结束后台线程 '''
+        self.barrier(timeout)
+        with self.__cond:
+            self.__running = False
+            self.__cond.notify_all()
+        self.__thread.join(timeout)
+
+    def __loop(self):
+        while True:
+            with self.__cond:
+                while self.__running and not self.__slots:
+                    self.__cond.wait()
+                if not self.__slots:
+                    return
+            # 限速: 等待期间槽保持待发送, 此间到达的新值直接覆盖
+            delay = self.__next_send - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            with self.__cond:
+                func_name, (plan, command) = self.__slots.popitem(last=False)
+                self.__busy = True
+
+            begin = time.time()
+            self.__next_send = begin + max(len(command) * self.rig.link_byte_time(), self.min_interval)
+            try:
+                if not self.rig.write_set(plan, command):
+                    self.rig.logger.warning('SET_COALESCER write failed: %s' % command)
+            except Exception, e:
+                self.rig.logger.error('SET_COALESCER error: %s' % e)
+
+            with self.__cond:
+                self.sent += 1
+                self.__busy = False
+                self.__cond.notify_all()
+
+class CONNECTION_SUPERVISOR(object):
+    # 连接监控: 后台线程维持串口连接, 调用方线程不执行重连逻辑.
+    # 1. 断线后按指数退避重连, 重连成功后可按原顺序重发最近的SET命令(replay)
+    # 2. 连接期间每health_interval秒以ID_GET检查设备是否应答, 连续失败则断开重连
+    # 3. 状态变化时通知监听者 callback(状态, 说明), 状态为以下三者之一
+    CONNECTED = 'CONNECTED'
+    DISCONNECTED = 'DISCONNECTED'
+    RECONNECTING = 'RECONNECTING'
+
+    def __init__(self, rig, port, baudrate=38400, replay=False, health_interval=5.0,
+        backoff_min=0.5, backoff_max=30.0, health_retries=2, callback=None):
+        self.rig = rig
+        self.port = port
+        self.baudrate = baudrate
+        self.replay = replay
+        self.health_interval = health_interval
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.health_retries = health_retries
+        self.reconnects = 0     # 重连成功次数
+        self.__state = self.DISCONNECTED
+        self.__connected = threading.Event()
+        self.__wake = threading.Event()     # 停止或调用方发现断线时唤醒监控线程
+        self.__listeners = [callback] if callback is not None else []
+        self.__stop = threading.Event()
+        self.__thread = None
+        rig.supervisor = self
+
+    def add_listener(self, callback):
+        self.__listeners.append(callback)
+
+    def state(self):
+        return self.__state
+
+    def wait_connected(self, timeout=None):
+        ''' 等待连接可用, 超时返回False. 串口已关闭而监控线程尚未发现时, 立即唤醒其重连 '''
+        deadline = time.time() + timeout if timeout is not None else None
+        while not self.rig.connect_status():
+            self.__connected.clear()
+            self.__wake.set()
+            remain = deadline - time.time() if deadline is not None else None
+            if remain is not None and remain <= 0:
+                return False
+            self.__connected.wait(remain)
+        return True
+
+    def start(self):
+        if self.__thread is not None:
+            return
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__loop, name='SUPERVISOR-%s' % self.rig.model)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        ''' 停止监控, 不关闭串口 '''
+        self.__stop.set()
+        self.__wake.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        if self.rig.supervisor is self:
+            self.rig.supervisor = None
+
+    def __set_state(self, state, info=''):
+        if state == self.__state:
+            return
+        self.__state = state
+        if state == self.CONNECTED:
+            self.__connected.set()
+        else:
+            self.__connected.clear()
+        self.rig.logger.info('connection %s: %s@%s %s' % (state, self.port, self.baudrate, info))
+        for callback in self.__listeners:
+            try:
+                callback(state, info)
+            except Exception, e:
+                self.rig.logger.error('supervisor callback error: %s' % e)
+
+    def health_check(self):
+        ''' 发送ID;确认设备应答, 不使用读缓存 '''
+        plan = self.rig.get_plans().get('ID_GET')
+        if plan is None:
+            return self.rig.connect_status()
+        return self.rig.cmd_rw(plan.cmd, func_name='ID_GET') is not None
+
+    def __loop(self):
+        backoff = self.backoff_min
+        first = True
+        while not self.__stop.is_set():
+            if not self.rig.connect_status():
+                if self.__state == self.CONNECTED:
+                    self.__set_state(self.DISCONNECTED, 'port closed')
+                self.__set_state(self.RECONNECTING)
+                if self.rig.connect(self.port, self.baudrate) and self.health_check():
+                    backoff = self.backoff_min
+                    if not first:
+                        self.reconnects += 1
+                        if self.replay:
+                            self.rig.logger.info('replay %d settings.' % self.rig.replay_sets())
+                    first = False
+                    self.__set_state(self.CONNECTED)
+                else:
+                    self.rig.close()
+                    self.__wake.clear()
+                    self.__wake.wait(backoff)
+                    backoff = min(backoff * 2, self.backoff_max)
+                continue
+
+            # 连接中: 定期检查串口状态, 每health_interval秒检查设备应答
+            deadline = time.time() + self.health_interval
+            while not self.__stop.is_set() and self.rig.connect_status() and time.time() < deadline:
+                self.__wake.clear()
+                self.__wake.wait(0.1)
+            if self.__stop.is_set() or not self.rig.connect_status():
+                continue
+            for i in range(self.health_retries):
+                if self.health_check():
+                    break
+            else:
+                self.rig.logger.warning('health check failed: %s@%s' % (self.port, self.baudrate))
+                self.rig.close()
+
 def find_secret_command():
     cmds = [chr(a)+chr(b)+c+';' for a in range(65,91) for b in range(65,91) for c in ('','0')]
     a = RIG_CREATOR()
@@ -591,8 +2460,8 @@ def demo():
     rig.func_exec('VFO_A_GET', debug=True)   # GET的调试功能, 会认为设备返回[DEBUG]中的数据, 然后解析返回, 测试用
     rig.func_exec('AF_GAIN_SET', VAL=10)     # SET, 参数名称参考配置文件, 如YEASU_CAT3.yaml
 
-    cmds = rig.get_func()                   # 获取全部命令的配置
-    for k in cmds.keys():
+    rig.get_func('AF_GAIN_SET')             # 获取某功能的配置, get_func()为全部命令的配置
+    for k in rig.func_names():
         if k.endswith('_GET'):
             rig.func_exec(k, debug=False)    # 批量测试所有GET命令
 
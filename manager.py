@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# 多设备管理: 按配置文件(conf/rigs.yaml)创建并连接多台电台, 并行轮询指定功能.
+# 1. 每台设备由独立的工作线程(ASYNC_YAESU_CAT)收发, 慢速或离线设备不阻塞其他设备.
+# 2. 轮询结果合并为快照, 每台设备附带完成时间和耗时.
+
+import time
+import threading
+
+import device
+
+class RIG_MANAGER(object):
+    # 多设备管理类, 持有N台设备及其工作线程
+    def __init__(self, conf_path='conf/rigs.yaml', creator=None):
+        self.logger = device.get_logger()
+        with open(conf_path, 'r') as f:
+            conf = device.yaml_load(f)
+
+        poll = conf.get('POLL') or {}
+        self.interval = poll.get('INTERVAL', 1.0)
+        self.timeout = poll.get('TIMEOUT', 2.0)
+        self.funcs = poll.get('FUNCS') or []
+
+        creator = creator or device.RIG_CREATOR()
+        self.__rigs = {}        # 设备名称 -> ASYNC_YAESU_CAT
+        self.__conf = {}        # 设备名称 -> 设备配置
+        self.__pending = {}     # 设备名称 -> 未完成的轮询CMD_FUTURE
+        self.__snapshot = {}
+        self.__lock = threading.Lock()
+        self.__thread = None
+        self.__running = False
+
+        for name, rig_conf in (conf.get('RIGS') or {}).iteritems():
+            rig = creator.get(rig_conf['MODEL'])
+            if rig is None:
+                self.logger.error('rig [%s] create failed.' % name)
+                continue
+            self.__rigs[name] = device.ASYNC_YAESU_CAT(rig)
+            self.__conf[name] = rig_conf
+            self.__snapshot[name] = self.__entry(name, 'INIT')
+
+    def names(self):
+        return sorted(self.__rigs.keys())
+
+    def rig(self, name):
+        ''' 返回设备的ASYNC_YAESU_CAT, 可直接提交命令 '''
+        return self.__rigs[name]
+
+    def connect(self, timeout=5.0):
+        ''' 所有设备并行连接, 返回 {设备名称: 是否成功} '''
+        futures = {}
+        for name, arig in self.__rigs.iteritems():
+            rig_conf = self.__conf[name]
+            futures[name] = arig.submit('connect', (rig_conf['PORT'], rig_conf.get('BAUDRATE', 38400)))
+
+        deadline = time.time() + timeout
+        ret = {}
+        for name, future in futures.iteritems():
+            try:
+                ret[name] = bool(future.result(max(deadline - time.time(), 0)))
+            except device.CMD_TIMEOUT:
+                ret[name] = False
+            if not ret[name]:
+                self.logger.error('rig [%s] connect failed: %s@%s' % (
+                    name, self.__conf[name]['PORT'], self.__conf[name].get('BAUDRATE', 38400)))
+        return ret
+
+    def poll_once(self, funcs=None, timeout=None):
+        '''
+        向所有设备并行提交一次批量读取, 在timeout内等待, 返回合并后的快照.
+        上一次轮询仍未完成的设备不重复提交(BUSY), 超时设备保留上次数据(TIMEOUT).
+        '''
+        funcs = funcs or self.funcs
+        timeout = self.timeout if timeout is None else timeout
+
+        submitted = {}
+        for name, arig in self.__rigs.iteritems():
+            future = self.__pending.get(name)
+            if future is not None and not future.done():
+                self.__update(name, 'BUSY')
+                continue
+            future = arig.func_exec_many(funcs)
+            self.__pending[name] = future
+            submitted[name] = future
+
+        deadline = time.time() + timeout
+        for name, future in submitted.iteritems():
+            if not future.wait(max(deadline - time.time(), 0)):
+                self.__update(name, 'TIMEOUT')
+                continue
+            try:
+                data = future.result()
+            except Exception, e:
+                self.logger.error('rig [%s] poll error: %s' % (name, e))
+                self.__update(name, 'ERROR')
+                continue
+            ok = len([v for v in (data or {}).itervalues() if v is not None])
+            if not ok:
+                self.__update(name, 'ERROR')
+            else:
+                self.__update(name, 'OK' if ok == len(data) else 'PARTIAL', data,
+                    future.finished, future.finished - future.started)
+        return self.snapshot()
+
+    def snapshot(self):
+        ''' 返回最近一次的合并快照 {设备名称: {STATUS, TIME, LATENCY, DATA, ...}} '''
+        with self.__lock:
+            return dict((k, dict(v)) for k, v in self.__snapshot.iteritems())
+
+    def start(self, interval=None):
+        ''' 后台按间隔持续轮询 '''
+        if self.__running:
+            return
+        if interval is not None:
+            self.interval = interval
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__loop, name='RIG_MANAGER')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        ''' 停止后台轮询并关闭所有设备的工作线程 '''
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        for arig in self.__rigs.itervalues():
+            arig.close(self.timeout)
+
+    def __loop(self):
+        while self.__running:
+            begin = time.time()
+            self.poll_once()
+            time.sleep(max(self.interval - (time.time() - begin), 0))
+
+    def __entry(self, name, status, data=None, ts=None, latency=None):
+        rig_conf = self.__conf[name]
+        return {
+            'MODEL': rig_conf['MODEL'],
+            'PORT': rig_conf['PORT'],
+            'STATUS': status,
+            'TIME': ts,
+            'LATENCY': latency,
+            'DATA': data,
+            }
+
+    def __update(self, name, status, data=None, ts=None, latency=None):
+        with self.__lock:
+            if data is None:
+                # 失败时保留上次数据和时间, 由TIME判断数据新旧
+                self.__snapshot[name]['STATUS'] = status
+            else:
+                self.__snapshot[name] = self.__entry(name, status, data, ts, latency)
+
+def demo():
+    manager = RIG_MANAGER('conf/rigs.yaml')
+    print manager.connect()
+    manager.start()
+    try:
+        while True:
+            time.sleep(manager.interval)
+            for name, entry in sorted(manager.snapshot().iteritems()):
+                print '%s [%s] %s' % (name, entry['STATUS'], entry['DATA'])
+    except KeyboardInterrupt:
+        manager.stop()
+
+if __name__ == '__main__':
+    demo()
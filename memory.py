@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# 存储频道批量备份/恢复: 多个MR/MW命令一次写入(func_exec_seq), 不再每个频道一次往返.
+# 1. 频道内容为 MEMORY_CHANNEL_GET 解析后的字典(不含CHANNEL), 以 {频道号: 字典} 表示,
+#    空频道(设备返回?;)不在其中.
+# 2. 文件为YAML格式, 可手工编辑.
+# 3. 恢复时先读取设备当前内容, 只写入有变化的频道, 写入后回读校验.
+#
+# 用法: python memory.py -r /dev/ttyUSB0 dump backup.yaml
+#       python memory.py -r /dev/ttyUSB1 restore backup.yaml
+
+import sys
+import argparse
+import yaml
+
+import device
+
+GET_FUNC = 'MEMORY_CHANNEL_GET'
+SET_FUNC = 'MEMORY_CHANNEL_SET'
+
+DEFAULT_CHANNELS = range(1, 100)
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def read_channels(rig, channels=DEFAULT_CHANNELS, batch=20):
+    '''
+    批量读取存储频道, 返回 {频道号: 频道内容}, 空频道不包含在内.
+    连接失败返回None.
+    '''
+    result = {}
+    for chunk in _chunks(list(channels), batch):
+        ret = rig.func_exec_seq([(GET_FUNC, {'CHANNEL': ch}) for ch in chunk])
+        if ret is None:
+            return
+        for ch, data in zip(chunk, ret):
+            if data is not None:
+                data = dict(data)
+                data.pop('CHANNEL', None)
+                result[ch] = data
+    return result
+
+def write_channels(rig, memory, batch=20):
+    ''' 批量写入存储频道, memory为 {频道号: 频道内容}, 成功返回True '''
+    for chunk in _chunks(sorted(memory), batch):
+        items = [(SET_FUNC, dict(memory[ch], CHANNEL=ch)) for ch in chunk]
+        if rig.func_exec_seq(items) is None:
+            return False
+    return True
+
+def diff(old, new):
+    '''
+    比较两组频道, 返回 {'CHANGED': [...], 'ADDED': [...], 'REMOVED': [...]}:
+    CHANGED为两者均有且内容不同, ADDED为仅new中有, REMOVED为仅old中有.
+    '''
+    return {
+        'CHANGED': sorted(ch for ch in new if ch in old and old[ch] <> new[ch]),
+        'ADDED': sorted(ch for ch in new if ch not in old),
+        'REMOVED': sorted(ch for ch in old if ch not in new),
+        }
+
+def save(path, memory, model=None):
+    with open(path, 'w') as f:
+        yaml.safe_dump({'MODEL': model, 'CHANNELS': memory}, f, default_flow_style=False)
+
+def load(path):
+    ''' 读取频道文件, 返回 (型号, {频道号: 频道内容}) '''
+    with open(path, 'r') as f:
+        conf = device.yaml_load(f) or {}
+    return conf.get('MODEL'), conf.get('CHANNELS') or {}
+
+def sync(rig, memory, verify=True, batch=20):
+    '''
+    将memory写入设备: 先读取设备上对应频道, 只写入有变化和新增的频道.
+    verify为True时回读写入的频道, 不一致的频道记入'FAILED'.
+    返回diff结果(另含'FAILED'), 连接失败返回None.
+    '''
+    current = read_channels(rig, sorted(memory), batch)
+    if current is None:
+        return
+    changes = diff(current, memory)
+    changes['REMOVED'] = []     # 只比较memory中的频道
+    todo = changes['CHANGED'] + changes['ADDED']
+    changes['FAILED'] = []
+    if not todo:
+        return changes
+    if not write_channels(rig, dict((ch, memory[ch]) for ch in todo), batch):
+        changes['FAILED'] = todo
+        return changes
+    if verify:
+        written = read_channels(rig, todo, batch) or {}
+        changes['FAILED'] = [ch for ch in todo if written.get(ch) <> memory[ch]]
+    return changes
+
+def main():
+    parser = argparse.ArgumentParser(description='Yaesu memory channel dump/restore')
+    parser.add_argument('-m', '--model', default='FT-891')
+    parser.add_argument('-r', '--rig-file', required=True, help='串口设备')
+    parser.add_argument('-s', '--serial-speed', type=int, default=38400)
+    parser.add_argument('action', choices=['dump', 'restore', 'diff'])
+    parser.add_argument('path', help='频道文件(YAML)')
+    args = parser.parse_args()
+
+    rig = device.RIG_CREATOR().get(args.model)
+    if rig is None or not rig.connect(args.rig_file, args.serial_speed):
+        sys.exit(1)
+    try:
+        if args.action == 'dump':
+            memory = read_channels(rig)
+            if memory is None:
+                sys.exit(1)
+            save(args.path, memory, args.model)
+            print '%d channels saved.' % len(memory)
+        else:
+            model, memory = load(args.path)
+            if args.action == 'diff':
+                current = read_channels(rig)
+                if current is None:
+                    sys.exit(1)
+                print diff(current, memory)
+            else:
+                changes = sync(rig, memory)
+                if changes is None:
+                    sys.exit(1)
+                print changes
+                if changes['FAILED']:
+                    sys.exit(1)
+    finally:
+        rig.close()
+
+if __name__ == '__main__':
+    main()
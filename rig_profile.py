@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# 设置档案: 保存/切换一组设备设置(如SSB比赛, FT8, CW).
+# 1. 快照: 所有有对应_SET(参数与_GET返回字段一致)的_GET一次批量读取(func_exec_many),
+#    保存为 {SET功能名: 参数} 的YAML文件, 可手工编辑删减.
+# 2. 应用: 按依赖分阶段(频率/VFO -> 模式 -> 滤波器 -> 其他), 每阶段先批量读取当前值,
+#    只一次写入有变化的设置, 最后回读校验. 模式切换后设备会载入该模式的滤波器等设置,
+#    因此后一阶段的当前值在前一阶段写入之后读取.
+#
+# 用法: python rig_profile.py -r /dev/ttyUSB0 snapshot ft8.yaml
+#       python rig_profile.py -r /dev/ttyUSB0 apply ft8.yaml
+
+import sys
+import time
+import argparse
+import yaml
+
+import device
+
+# 不保存到档案的设置: 发射, 电源, 扫描等操作类功能
+EXCLUDE = ('MOX_SET', 'TX_SETTING_SET', 'POWER_SET', 'SCAN_SET', 'CW_SPOT_SET', 'VFO_M_SET')
+
+# 应用顺序, 未列出的设置在最后阶段
+STAGES = (
+    ('VFO_A_FREQ_SET', 'VFO_B_FREQ_SET', 'SPLIT_SET'),
+    ('MODE_SET',),
+    ('NARROW_SET', 'IF_SHIFT_SET', 'CONTOUR_SET', 'CONTOUR_FREQ_SET', 'APF_SET', 'APF_FREQ_SET',
+        'NOTCH_AUTO_SET', 'NOTCH_MANUAL_SET'),
+    )
+
+def get_func_name(set_name):
+    return set_name[:-len('_SET')] + '_GET'
+
+def profile_funcs(rig, exclude=EXCLUDE):
+    ''' 可保存到档案的SET功能名列表: 有对应的无参数_GET, 且SET参数与GET返回字段一致 '''
+    plans = rig.get_plans()
+    funcs = []
+    for func_name in rig.func_names():
+        if not func_name.endswith('_SET') or func_name in exclude:
+            continue
+        get_plan = plans.get(get_func_name(func_name))
+        if get_plan is None or get_plan.params:
+            continue
+        if set(plans[func_name].params) == set(k for k, b, e, conv in get_plan.rets):
+            funcs.append(func_name)
+    return funcs
+
+def stage_of(func_name):
+    for i, stage in enumerate(STAGES):
+        if func_name in stage:
+            return i
+    return len(STAGES)
+
+def read_settings(rig, funcs):
+    ''' 批量读取SET功能对应的当前值, 返回 {SET功能名: 参数}, 读取失败的功能不包含在内. 连接失败返回None '''
+    ret = rig.func_exec_many([get_func_name(f) for f in funcs])
+    if ret is None:
+        return
+    return dict((f, ret[get_func_name(f)]) for f in funcs if isinstance(ret.get(get_func_name(f)), dict))
+
+def encoded(rig, func_name, kwargs):
+    ''' 按SET计划编码参数, 返回命令; 参数为None或不能编码(DIM中没有)时返回None '''
+    if kwargs is None:
+        return
+    try:
+        return rig.get_plans()[func_name].encode(kwargs)
+    except Exception:
+        return
+
+def encodable(rig, func_name, kwargs):
+    return encoded(rig, func_name, kwargs) is not None
+
+def snapshot(rig, funcs=None):
+    '''
+    读取当前设置, 返回 {SET功能名: 参数}, 连接失败返回None.
+    当前值不能写回的设置(如AGC_GET返回的AUTO_SLOW)不包含在内.
+    '''
+    settings = read_settings(rig, funcs or profile_funcs(rig))
+    if settings is None:
+        return
+    for func_name, kwargs in settings.items():
+        if not encodable(rig, func_name, kwargs):
+            rig.logger.info('profile: skip %s %s' % (func_name, kwargs))
+            del settings[func_name]
+    return settings
+
+def save(path, settings, model=None):
+    with open(path, 'w') as f:
+        yaml.safe_dump({'MODEL': model, 'SETTINGS': settings}, f, default_flow_style=False)
+
+def load(path):
+    ''' 读取档案文件, 返回 (型号, {SET功能名: 参数}) '''
+    with open(path, 'r') as f:
+        conf = device.yaml_load(f) or {}
+    return conf.get('MODEL'), conf.get('SETTINGS') or {}
+
+def apply(rig, settings, verify=True):
+    '''
+    应用档案, 只写入与当前值不同的设置, 按STAGES顺序分阶段.
+    比较编码后的SET命令而非解析值: 有损的CONVERT(如RF_GAIN读x/3.33, 写x*3.33)解析值不能往返.
+    返回 {'CHANGED': [...], 'UNCHANGED': [...], 'FAILED': [...]}, 连接失败返回None.
+    '''
+    # 写入前先校验全部参数, 避免只应用了部分阶段
+    invalid = sorted(f for f, kwargs in settings.iteritems() if not encodable(rig, f, kwargs))
+    if invalid:
+        rig.logger.error('profile: invalid settings %s' % invalid)
+        return
+    stages = {}
+    for func_name in settings:
+        stages.setdefault(stage_of(func_name), []).append(func_name)
+
+    result = {'CHANGED': [], 'UNCHANGED': [], 'FAILED': []}
+    for i in sorted(stages):
+        funcs = sorted(stages[i])
+        current = read_settings(rig, funcs)
+        if current is None:
+            return
+        todo = [f for f in funcs if encoded(rig, f, current.get(f)) <> encoded(rig, f, settings[f])]
+        result['UNCHANGED'].extend(f for f in funcs if f not in todo)
+        if not todo:
+            continue
+        if rig.func_exec_seq([(f, settings[f]) for f in todo]) is None:
+            return
+        result['CHANGED'].extend(todo)
+
+    if verify and result['CHANGED']:
+        written = read_settings(rig, result['CHANGED'])
+        if written is None:
+            return
+        result['FAILED'] = [f for f in result['CHANGED']
+            if encoded(rig, f, written.get(f)) <> encoded(rig, f, settings[f])]
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Yaesu settings profile snapshot/apply')
+    parser.add_argument('-m', '--model', default='FT-891')
+    parser.add_argument('-r', '--rig-file', required=True, help='串口设备')
+    parser.add_argument('-s', '--serial-speed', type=int, default=38400)
+    parser.add_argument('action', choices=['snapshot', 'apply'])
+    parser.add_argument('path', help='档案文件(YAML)')
+    args = parser.parse_args()
+
+    rig = device.RIG_CREATOR().get(args.model)
+    if rig is None or not rig.connect(args.rig_file, args.serial_speed):
+        sys.exit(1)
+    try:
+        begin = time.time()
+        if args.action == 'snapshot':
+            settings = snapshot(rig)
+            if settings is None:
+                sys.exit(1)
+            save(args.path, settings, args.model)
+            print '%d settings saved in %.2fs.' % (len(settings), time.time() - begin)
+        else:
+            model, settings = load(args.path)
+            if model and model <> args.model:
+                print 'profile is for %s, not %s.' % (model, args.model)
+                sys.exit(1)
+            result = apply(rig, settings)
+            if result is None:
+                sys.exit(1)
+            print '%d changed, %d unchanged in %.2fs.' % (
+                len(result['CHANGED']), len(result['UNCHANGED']), time.time() - begin)
+            if result['FAILED']:
+                print 'failed:', result['FAILED']
+                sys.exit(1)
+    finally:
+        rig.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# rigctld兼容的TCP服务: 由本进程独占串口, 多个客户端(日志, 数字模式软件, 监控页面)
+# 通过Hamlib rigctld文本协议(NET rigctl, 模型2)共享同一台电台.
+# 1. 协议命令映射到YAESU_CAT3.yaml中的_GET/_SET功能, 串口收发由ASYNC_YAESU_CAT串行执行.
+# 2. 多个客户端同时读取同一功能时合并为一次串口读取, 短时间内的重复读取直接返回缓存.
+# 3. 已实现: 频率, 模式, PTT, VFO, 电平读取/设置(AF/RF/SQL/MICGAIN/RFPOWER/STRENGTH/SWR/ALC等)
+#
+# 用法: python rigctld.py -m FT-891 -r /dev/ttyUSB0 -s 38400 -t 4532
+
+import time
+import argparse
+import threading
+import SocketServer
+
+import device
+
+# Hamlib 错误码
+RIG_OK = 0
+RIG_EINVAL = -1
+RIG_ENIMPL = -4
+RIG_ETIMEOUT = -5
+RIG_ENAVAIL = -11
+
+# Hamlib模式名 <-> MODE_SET/MODE_GET中的模式名
+MODE_TO_RIG = {
+    'LSB': 'LSB',
+    'USB': 'USB',
+    'CW': 'CW-U',
+    'CWR': 'CW-L',
+    'AM': 'AM',
+    'FM': 'FM',
+    'FMN': 'FM-N',
+    'RTTY': 'RTTY-LSB',
+    'RTTYR': 'RTTY-USB',
+    'PKTLSB': 'DATA-LSB',
+    'PKTUSB': 'DATA-USB',
+    'PKTFM': 'DATA-FM',
+    }
+MODE_FROM_RIG = dict((v, k) for k, v in MODE_TO_RIG.iteritems())
+MODE_FROM_RIG['AM-N'] = 'AM'
+
+# S表读数(SM0, 0~255)到相对S9的dB, 分段线性插值
+STRENGTH_CAL = (
+    (0, -54), (12, -48), (27, -42), (40, -36), (55, -30), (65, -24), (80, -18),
+    (95, -12), (112, -6), (130, 0), (150, 10), (172, 20), (190, 30), (220, 40),
+    (240, 50), (255, 60),
+    )
+# 驻波表读数(RM6, 0~255)到驻波比
+SWR_CAL = ((0, 1.0), (26, 1.2), (52, 1.5), (89, 2.0), (255, 5.0))
+
+def interpolate(cal, raw):
+    ''' 按校准表分段线性插值 '''
+    if raw <= cal[0][0]:
+        return cal[0][1]
+    for (x0, y0), (x1, y1) in zip(cal, cal[1:]):
+        if raw <= x1:
+            return y0 + (y1 - y0) * float(raw - x0) / (x1 - x0)
+    return cal[-1][1]
+
+# 电平: Hamlib电平名 -> (_GET功能, 读取转换, _SET功能, _SET参数名, 设置转换)
+# 百分比类电平在Hamlib中为0.0~1.0
+_PERCENT_GET = lambda v: v / 100.0
+_PERCENT_SET = lambda v: int(round(v * 100))
+LEVELS = {
+    'AF': ('AF_GAIN_GET', _PERCENT_GET, 'AF_GAIN_SET', 'VAL', _PERCENT_SET),
+    'RF': ('RF_GAIN_GET', _PERCENT_GET, 'RF_GAIN_SET', 'VAL', _PERCENT_SET),
+    'SQL': ('SQL_LEVEL_GET', _PERCENT_GET, 'SQL_LEVEL_SET', 'VAL', _PERCENT_SET),
+    'MICGAIN': ('MIC_GAIN_GET', _PERCENT_GET, 'MIC_GAIN_SET', 'VAL', _PERCENT_SET),
+    'RFPOWER': ('RF_POWER_GET', _PERCENT_GET, 'RF_POWER_SET', 'VAL', _PERCENT_SET),
+    'VOXGAIN': ('VOX_GAIN_GET', _PERCENT_GET, 'VOX_GAIN_SET', 'VAL', _PERCENT_SET),
+    'KEYSPD': ('CW_SPEED_GET', int, 'CW_SPEED_SET', 'SPEED', int),
+    'CWPITCH': ('CW_PITCH_GET', int, 'CW_PITCH_SET', 'FREQ', int),
+    'STRENGTH': ('METER_S_READING_GET', lambda v: int(round(interpolate(STRENGTH_CAL, v))), None, None, None),
+    'RAWSTR': ('METER_S_READING_GET', int, None, None, None),
+    'SWR': ('METER_SWR_GET', lambda v: interpolate(SWR_CAL, v), None, None, None),
+    'ALC': ('METER_ALC_GET', lambda v: v / 255.0, None, None, None),
+    'COMP': ('METER_CMP_GET', lambda v: v / 255.0, None, None, None),
+    }
+
+# Hamlib电平位, 用于dump_state
+LEVEL_BITS = {
+    'AF': 1 << 3, 'RF': 1 << 4, 'SQL': 1 << 5, 'CWPITCH': 1 << 11, 'RFPOWER': 1 << 12,
+    'MICGAIN': 1 << 13, 'KEYSPD': 1 << 14, 'COMP': 1 << 16, 'VOXGAIN': 1 << 21,
+    'RAWSTR': 1 << 26, 'SWR': 1 << 28, 'ALC': 1 << 29, 'STRENGTH': 1 << 30,
+    }
+MODE_BITS = 0x1dbf      # AM|CW|USB|LSB|RTTY|FM|CWR|RTTYR|PKTLSB|PKTUSB|PKTFM
+
+class RIGCTLD_BACKEND(object):
+    # 串口访问层: 所有读写经ASYNC_YAESU_CAT串行执行.
+    # 读取: 同一功能的并发读取只发送一次(后到者等待同一结果), window秒内的重复读取返回缓存.
+    # 写入: 成功后清空读缓存, 保证之后的读取反映新状态.
+    def __init__(self, arig, window=0.2, timeout=2.0):
+        self.arig = arig
+        self.window = window
+        self.timeout = timeout
+        self.__lock = threading.RLock()     # 已完成的CMD_FUTURE会在注册回调时同步调用__done
+        self.__cache = {}       # 功能名 -> (时间, 结果)
+        self.__inflight = {}    # 功能名 -> CMD_FUTURE
+        self.reads = 0          # 客户端读取次数
+        self.serial_reads = 0   # 实际串口读取次数
+
+    def read(self, func_name):
+        ''' 读取_GET功能, 失败返回None '''
+        with self.__lock:
+            self.reads += 1
+            entry = self.__cache.get(func_name)
+            if entry is not None and time.time() - entry[0] < self.window:
+                return entry[1]
+            future = self.__inflight.get(func_name)
+            if future is None:
+                self.serial_reads += 1
+                future = self.arig.func_exec(func_name, timeout=self.timeout)
+                self.__inflight[func_name] = future
+                future.add_done_callback(lambda f: self.__done(func_name, f))
+        try:
+            return future.result(self.timeout)
+        except Exception, e:
+            return
+
+    def write(self, func_name, **kwargs):
+        ''' 执行_SET功能, 返回是否成功 '''
+        try:
+            ret = self.arig.func_exec(func_name, timeout=self.timeout, **kwargs).result(self.timeout)
+        except Exception, e:
+            self.arig.rig.logger.warning('rigctld write error: %s %s' % (func_name, e))
+            return False
+        with self.__lock:
+            self.__cache.clear()
+        return bool(ret)
+
+    def __done(self, func_name, future):
+        with self.__lock:
+            self.__inflight.pop(func_name, None)
+            try:
+                ret = future.result()
+            except Exception, e:
+                ret = None
+            if ret is not None:
+                self.__cache[func_name] = (future.finished, ret)
+
+class RIGCTLD_HANDLER(SocketServer.StreamRequestHandler):
+    # 单个客户端连接, 逐行解析rigctld命令
+    # 命令表: 短命令/长命令 -> (处理方法, 参数个数)
+    COMMANDS = {
+        'f': ('get_freq', 0), 'F': ('set_freq', 1),
+        'm': ('get_mode', 0), 'M': ('set_mode', 2),
+        't': ('get_ptt', 0), 'T': ('set_ptt', 1),
+        'v': ('get_vfo', 0), 'V': ('set_vfo', 1),
+        's': ('get_split_vfo', 0),
+        'l': ('get_level', 1), 'L': ('set_level', 2),
+        '1': ('dump_caps', 0),
+        }
+    LONG_COMMANDS = {
+        'get_freq': 'f', 'set_freq': 'F', 'get_mode': 'm', 'set_mode': 'M',
+        'get_ptt': 't', 'set_ptt': 'T', 'get_vfo': 'v', 'set_vfo': 'V',
+        'get_split_vfo': 's', 'get_level': 'l', 'set_level': 'L', 'dump_caps': '1',
+        'dump_state': None, 'chk_vfo': None, 'get_powerstat': None, 'get_info': None,
+        }
+
+    def handle(self):
+        backend = self.server.backend
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            tokens = line.split()
+            while tokens:
+                cmd = tokens.pop(0)
+                if cmd in ('q', 'Q', '\\quit'):
+                    return
+                if cmd.startswith('\\'):
+                    name = cmd[1:]
+                    if name not in self.LONG_COMMANDS:
+                        self.reply_code(RIG_EINVAL)
+                        break
+                    short = self.LONG_COMMANDS[name]
+                    if short is None:
+                        self.reply(getattr(self, name)(backend))
+                        continue
+                    cmd = short
+                if cmd not in self.COMMANDS:
+                    self.reply_code(RIG_EINVAL)
+                    break
+                method, nargs = self.COMMANDS[cmd]
+                args, tokens = tokens[:nargs], tokens[nargs:]
+                if len(args) < nargs:
+                    self.reply_code(RIG_EINVAL)
+                    break
+                self.reply(getattr(self, method)(backend, *args))
+
+    def reply(self, ret):
+        ''' 处理方法返回int时为错误码(RPRT n), 返回list时逐行输出 '''
+        if isinstance(ret, int):
+            self.reply_code(ret)
+        else:
+            self.wfile.write(''.join('%s\n' % v for v in ret))
+
+    def reply_code(self, code):
+        self.wfile.write('RPRT %d\n' % code)
+
+    ############################ 命令实现 ############################
+
+    def get_freq(self, backend):
+        ret = backend.read('VFO_A_FREQ_GET')
+        return [int(ret['FREQ'])] if ret else RIG_ETIMEOUT
+
+    def set_freq(self, backend, freq):
+        try:
+            freq = int(float(freq))
+        except ValueError:
+            return RIG_EINVAL
+        return RIG_OK if backend.write('VFO_A_FREQ_SET', FREQ=freq) else RIG_ETIMEOUT
+
+    def get_mode(self, backend):
+        ret = backend.read('MODE_GET')
+        if not ret:
+            return RIG_ETIMEOUT
+        return [MODE_FROM_RIG.get(ret['MODE'], ret['MODE']), 0]
+
+    def set_mode(self, backend, mode, passband):
+        if mode == '?':
+            return [' '.join(sorted(MODE_TO_RIG))]
+        if mode not in MODE_TO_RIG:
+            return RIG_EINVAL
+        return RIG_OK if backend.write('MODE_SET', MODE=MODE_TO_RIG[mode]) else RIG_ETIMEOUT
+
+    def get_ptt(self, backend):
+        ret = backend.read('TX_GET')
+        return [1 if ret['STATUS'] == 'ON' else 0] if ret else RIG_ETIMEOUT
+
+    def set_ptt(self, backend, ptt):
+        status = 'OFF' if ptt == '0' else 'ON'
+        return RIG_OK if backend.write('MOX_SET', STATUS=status) else RIG_ETIMEOUT
+
+    def get_vfo(self, backend):
+        return ['VFOA']
+
+    def set_vfo(self, backend, vfo):
+        return RIG_OK if vfo in ('VFOA', 'currVFO') else RIG_ENAVAIL
+
+    def get_split_vfo(self, backend):
+        return [0, 'VFOA']
+
+    def get_level(self, backend, level):
+        if level == '?':
+            return [' '.join(sorted(LEVELS))]
+        if level not in LEVELS:
+            return RIG_EINVAL
+        func_get, conv_get = LEVELS[level][:2]
+        ret = backend.read(func_get)
+        if not ret:
+            return RIG_ETIMEOUT
+        val = conv_get(ret.values()[0])
+        return ['%f' % val if isinstance(val, float) else val]
+
+    def set_level(self, backend, level, val):
+        if level == '?':
+            return [' '.join(sorted(k for k, v in LEVELS.iteritems() if v[2]))]
+        if level not in LEVELS or LEVELS[level][2] is None:
+            return RIG_EINVAL
+        func_set, param, conv_set = LEVELS[level][2:]
+        try:
+            val = conv_set(float(val))
+        except ValueError:
+            return RIG_EINVAL
+        return RIG_OK if backend.write(func_set, **{param: val}) else RIG_ETIMEOUT
+
+    def chk_vfo(self, backend):
+        return [0]
+
+    def get_powerstat(self, backend):
+        return [1]
+
+    def get_info(self, backend):
+        return [backend.arig.rig.model]
+
+    def dump_caps(self, backend):
+        return ['Model name: %s' % backend.arig.rig.model, 'Mfg name: Yaesu', 'Backend: Yaesu_CAT_python']
+
+    def dump_state(self, backend):
+        ''' NET rigctl(模型2)连接时读取的能力描述, 协议版本0 '''
+        level_bits = 0
+        set_level_bits = 0
+        for name, conf in LEVELS.iteritems():
+            level_bits |= LEVEL_BITS.get(name, 0)
+            if conf[2]:
+                set_level_bits |= LEVEL_BITS.get(name, 0)
+        return [
+            0,                  # 协议版本
+            2,                  # 模型: NET rigctl
+            2,                  # ITU区域
+            '30000.000000 56000000.000000 0x%x -1 -1 0x1 0x0' % MODE_BITS,
+            '0 0 0 0 0 0 0',
+            '1800000.000000 54000000.000000 0x%x 5000 100000 0x1 0x0' % MODE_BITS,
+            '0 0 0 0 0 0 0',
+            '0x%x 10' % MODE_BITS,
+            '0 0',
+            '0x%x 2400' % MODE_BITS,
+            '0 0',
+            9999,               # max_rit
+            9999,               # max_xit
+            1200,               # max_ifshift
+            0,                  # announces
+            '',                 # preamp
+            '',                 # attenuator
+            '0x0', '0x0',       # has_get_func, has_set_func
+            '0x%x' % level_bits, '0x%x' % set_level_bits,
+            '0x0', '0x0',       # has_get_parm, has_set_parm
+            ]
+
+class RIGCTLD_SERVER(SocketServer.ThreadingTCPServer):
+    # 每个客户端一个线程, 共享同一个RIGCTLD_BACKEND
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, backend):
+        SocketServer.ThreadingTCPServer.__init__(self, address, RIGCTLD_HANDLER)
+        self.backend = backend
+
+def main():
+    parser = argparse.ArgumentParser(description='rigctld compatible server for Yaesu CAT')
+    parser.add_argument('-m', '--model', default='FT-891')
+    parser.add_argument('-r', '--rig-file', default='/dev/ttyUSB0')
+    parser.add_argument('-s', '--serial-speed', type=int, default=38400)
+    parser.add_argument('-T', '--listen-addr', default='127.0.0.1')
+    parser.add_argument('-t', '--port', type=int, default=4532)
+    parser.add_argument('-w', '--window', type=float, default=0.2, help='重复读取缓存窗口(秒)')
+    args = parser.parse_args()
+
+    rig = device.RIG_CREATOR().get(args.model)
+    if rig is None or not rig.connect(args.rig_file, args.serial_speed):
+        print 'Connect fail.'
+        return
+    backend = RIGCTLD_BACKEND(device.ASYNC_YAESU_CAT(rig), window=args.window)
+    server = RIGCTLD_SERVER((args.listen_addr, args.port), backend)
+    rig.logger.info('rigctld listening on %s:%d' % (args.listen_addr, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# 共享内存状态表: 一个进程持有串口(STATE_PUBLISHER), 将解析后的状态写入内存映射文件,
+# 本机其他进程(日志, 仪表盘等)用STATE_READER读取, 不访问串口, 不解析命令.
+# 1. 固定布局: 每个_GET返回字段一个槽, 槽名为 '功能名.返回名', 如 'VFO_A_FREQ_GET.FREQ'
+# 2. 每个槽有独立的序号(seqlock): 写入前后各加1, 读取时序号为奇数或前后不一致则重读,
+#    读者无锁且不阻塞写者
+# 3. 文件头有全局序号, 每次发布加1, wait_change 以此轮询等待变化
+# 4. 发布者每次启动都重建文件(新inode). 读者在wait_change中定期检查, 发现文件已重建时重新映射;
+#    只用get时需自行调用reopen(), 否则一直读取旧文件中的值.
+#
+# 文件布局(小端):
+#   文件头: MAGIC(4s) VERSION(B) 槽数(I) 全局序号(Q)
+#   槽名表: 槽数 x 名称(48s)
+#   槽数据: 槽数 x [序号(Q) 时间(d) 类型(B) 长度(B) 值(24s)]
+#
+# 用法: 发布  python shared_state.py -m FT-891 -r /dev/ttyUSB0 -s 38400
+#       读取  reader = shared_state.STATE_READER(); reader.get('VFO_A_FREQ_GET.FREQ')
+
+import os
+import sys
+import mmap
+import time
+import struct
+import argparse
+import tempfile
+import threading
+
+import device
+
+MAGIC = 'YCSM'
+VERSION = 1
+_HEADER = struct.Struct('<4sBIQ')
+_NAME = struct.Struct('<48s')
+_SLOT = struct.Struct('<QdBB6x24s')
+_SEQ = struct.Struct('<Q')
+_GLOBAL_SEQ_OFFSET = 9      # 文件头中全局序号的偏移
+
+SLOT_TIMEOUT = 0.1          # 槽一直处于写入中(发布者在写入中途退出)的最长等待(秒)
+REOPEN_CHECK = 0.5          # wait_change中检查文件是否重建的间隔(秒)
+
+# 槽值类型
+KIND_NONE, KIND_INT, KIND_FLOAT, KIND_STR = 0, 1, 2, 3
+VALUE_SIZE = 24
+
+DEFAULT_FUNCS = ('VFO_A_FREQ_GET', 'VFO_B_FREQ_GET', 'MODE_GET', 'METER_S_GET',
+    'METER_POW_GET', 'METER_SWR_GET', 'TX_GET')
+
+def default_path(model):
+    ''' 优先放在/dev/shm(内存文件系统), 否则放在临时目录 '''
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'yaesu-%s.state' % model)
+
+def _encode(value):
+    if value is None:
+        return KIND_NONE, 0, ''
+    if isinstance(value, bool) or isinstance(value, (int, long)):
+        return KIND_INT, 8, struct.pack('<q', value)
+    if isinstance(value, float):
+        return KIND_FLOAT, 8, struct.pack('<d', value)
+    value = str(value)[:VALUE_SIZE]
+    return KIND_STR, len(value), value
+
+def _decode(kind, size, data):
+    if kind == KIND_INT:
+        return struct.unpack_from('<q', data)[0]
+    if kind == KIND_FLOAT:
+        return struct.unpack_from('<d', data)[0]
+    if kind == KIND_STR:
+        return data[:size]
+
+class _STATE_TABLE(object):
+    # 布局计算, 发布者和读者共用
+    def __init__(self, names):
+        self.names = list(names)
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        self.data_offset = _HEADER.size + _NAME.size * len(self.names)
+        self.size = self.data_offset + _SLOT.size * len(self.names)
+
+    def slot_offset(self, i):
+        return self.data_offset + _SLOT.size * i
+
+class STATE_PUBLISHER(object):
+    # 状态发布者, 持有YAESU_CAT实例, 每个状态文件只能有一个发布者
+    def __init__(self, rig, funcs=DEFAULT_FUNCS, path=None):
+        '''
+        funcs: 发布的_GET功能(不含带参数的功能), 每个返回字段一个槽
+        path: 状态文件路径, 默认为 /dev/shm/yaesu-型号.state
+        '''
+        self.rig = rig
+        self.path = path or default_path(rig.model)
+        plans = rig.get_plans()
+        self.funcs = []
+        names = []
+        for func_name in funcs:
+            plan = plans.get(func_name)
+            if plan is None or not plan.is_get or plan.params:
+                rig.logger.error('STATE_PUBLISHER skip: %s' % func_name)
+                continue
+            self.funcs.append(func_name)
+            names.extend('%s.%s' % (func_name, k) for k, b, e, conv in sorted(plan.rets))
+        self.table = _STATE_TABLE(names)
+        self.publishes = 0
+
+        # 先写临时文件再改名, 读者不会看到未初始化的表
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, len(names), 0))
+            for name in names:
+                f.write(_NAME.pack(name))
+            f.write('\0' * (_SLOT.size * len(names)))
+        os.rename(tmp, self.path)
+        self.__file = open(self.path, 'r+b')
+        self.__map = mmap.mmap(self.__file.fileno(), self.table.size)
+        self.__seq = 0
+        self.__lock = threading.Lock()
+        self.__thread = None
+        self.__running = False
+
+    def publish(self, func_name, ret, ts=None):
+        ''' 写入一个功能的解析结果 {返回名: 值}, ret为None时不写入 '''
+        if not ret:
+            return
+        ts = ts or time.time()
+        index = self.table.index
+        with self.__lock:
+            for k, value in ret.iteritems():
+                i = index.get('%s.%s' % (func_name, k))
+                if i is None:
+                    continue
+                offset = self.table.slot_offset(i)
+                seq = _SEQ.unpack_from(self.__map, offset)[0]
+                kind, size, data = _encode(value)
+                _SEQ.pack_into(self.__map, offset, seq + 1)     # 奇数: 写入中
+                _SLOT.pack_into(self.__map, offset, seq + 1, ts, kind, size, data)
+                _SEQ.pack_into(self.__map, offset, seq + 2)
+            self.__seq += 1
+            _SEQ.pack_into(self.__map, _GLOBAL_SEQ_OFFSET, self.__seq)
+            self.publishes += 1
+
+    def on_change(self, func_name, new, old=None):
+        ''' 可作为rig.ai_start的callback, AI模式下状态变化即发布 '''
+        self.publish(func_name, new)
+
+    def poll_once(self):
+        ''' 批量读取一次所有功能并发布 '''
+        ret = self.rig.func_exec_many(self.funcs) or {}
+        ts = time.time()
+        for func_name in self.funcs:
+            self.publish(func_name, ret.get(func_name), ts)
+
+    def start(self, interval=0.2):
+        ''' 后台按间隔轮询并发布 '''
+        if self.__running:
+            return
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__loop, args=(interval,), name='STATE_PUBLISHER')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def close(self, remove=False):
+        self.stop()
+        self.__map.close()
+        self.__file.close()
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __loop(self, interval):
+        while self.__running:
+            begin = time.time()
+            try:
+                self.poll_once()
+            except Exception, e:
+                self.rig.logger.error('state publish error: %s' % e)
+            time.sleep(max(interval - (time.time() - begin), 0))
+
+class STATE_READER(object):
+    # 状态读者, 只读映射状态文件, 不访问串口
+    def __init__(self, path=None, model='FT-891'):
+        self.path = path or default_path(model)
+        self.__open()
+
+    def __open(self):
+        self.__file = open(self.path, 'rb')
+        stat = os.fstat(self.__file.fileno())
+        self.__inode = (stat.st_dev, stat.st_ino)
+        head = self.__file.read(_HEADER.size)
+        magic, version, count, seq = _HEADER.unpack(head)
+        assert magic == MAGIC, 'not a state file: %s' % self.path
+        assert version == VERSION, 'unsupported state file version: %d' % version
+        names = [_NAME.unpack(self.__file.read(_NAME.size))[0].rstrip('\0') for i in range(count)]
+        self.table = _STATE_TABLE(names)
+        self.__map = mmap.mmap(self.__file.fileno(), self.table.size, access=mmap.ACCESS_READ)
+
+    def reopen(self):
+        ''' 发布者重启后状态文件已重建时重新映射, 返回是否重新映射 '''
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False    # 发布者尚未重建文件, 继续使用旧映射
+        if (stat.st_dev, stat.st_ino) == self.__inode:
+            return False
+        self.close()
+        self.__open()
+        return True
+
+    def names(self):
+        return list(self.table.names)
+
+    def seq(self):
+        ''' 全局序号, 每次发布加1 '''
+        return _SEQ.unpack_from(self.__map, _GLOBAL_SEQ_OFFSET)[0]
+
+    def __read(self, i):
+        '''
+        seqlock一致读取, 返回 (序号, 时间, 值). 写入中则重读, 多次失败后让出CPU;
+        超过SLOT_TIMEOUT仍在写入(发布者在写入中途退出)抛出IOError.
+        '''
+        offset = self.table.slot_offset(i)
+        deadline = None
+        retries = 0
+        while True:
+            seq, ts, kind, size, data = _SLOT.unpack_from(self.__map, offset)
+            if not seq & 1 and _SEQ.unpack_from(self.__map, offset)[0] == seq:
+                return seq, ts, _decode(kind, size, data)
+            retries += 1
+            if retries < 100:
+                continue    # 写入中, 重读
+            now = time.time()
+            if deadline is None:
+                deadline = now + SLOT_TIMEOUT
+            elif now > deadline:
+                raise IOError('state slot stuck in write: %s' % self.table.names[i])
+            time.sleep(0)
+
+    def get(self, name, with_time=False):
+        '''
+        读取一个槽的值, name为 '功能名.返回名'. 未发布过的槽为None.
+        with_time为True时返回 (值, 发布时间)
+        '''
+        seq, ts, value = self.__read(self.table.index[name])
+        return (value, ts) if with_time else value
+
+    def get_func(self, func_name):
+        ''' 读取一个功能的全部返回字段 {返回名: 值} '''
+        prefix = func_name + '.'
+        return dict((name[len(prefix):], self.__read(i)[2])
+            for i, name in enumerate(self.table.names) if name.startswith(prefix))
+
+    def snapshot(self):
+        ''' 读取全部槽 {槽名: 值} '''
+        return dict((name, self.__read(i)[2]) for i, name in enumerate(self.table.names))
+
+    def wait_change(self, names=None, timeout=None, poll=0.001):
+        '''
+        阻塞等待槽的值被更新(发布, 值可能相同), 返回更新的槽名列表, 超时返回[].
+        names: 关注的槽名, 默认全部. 以poll秒间隔轮询全局序号, 无更新时间隔逐渐加大到20ms.
+        '''
+        indexes = [self.table.index[n] for n in names] if names else range(len(self.table.names))
+        before = dict((i, self.__read(i)[0]) for i in indexes)
+        deadline = time.time() + timeout if timeout is not None else None
+        next_check = time.time() + REOPEN_CHECK
+        seq = self.seq()
+        interval = poll
+        while True:
+            current = self.seq()
+            if current <> seq:
+                seq = current
+                changed = [self.table.names[i] for i in indexes if self.__read(i)[0] <> before[i]]
+                if changed:
+                    return changed
+                interval = poll
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                self.reopen()
+                return []
+            if now >= next_check:
+                next_check = now + REOPEN_CHECK
+                if self.reopen():
+                    # 文件已重建: 按新的槽名表重新定位, 之后发布的槽均视为更新
+                    index = self.table.index
+                    indexes = [index[n] for n in names if n in index] if names else range(len(self.table.names))
+                    before = dict((i, 0) for i in indexes)
+                    seq = None
+                    continue
+            time.sleep(interval)
+            interval = min(interval * 2, 0.02)
+
+    def close(self):
+        self.__map.close()
+        self.__file.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='publish Yaesu rig state to shared memory')
+    parser.add_argument('-m', '--model', default='FT-891')
+    parser.add_argument('-r', '--rig-file', required=True, help='串口设备')
+    parser.add_argument('-s', '--serial-speed', type=int, default=38400)
+    parser.add_argument('-i', '--interval', type=float, default=0.2, help='轮询间隔(秒)')
+    parser.add_argument('-f', '--funcs', nargs='+', default=list(DEFAULT_FUNCS))
+    parser.add_argument('-p', '--path', help='状态文件, 默认 /dev/shm/yaesu-型号.state')
+    args = parser.parse_args()
+
+    rig = device.RIG_CREATOR().get(args.model)
+    if rig is None or not rig.connect(args.rig_file, args.serial_speed):
+        sys.exit(1)
+    publisher = STATE_PUBLISHER(rig, args.funcs, args.path)
+    publisher.start(args.interval)
+    print 'publishing %d slots to %s' % (len(publisher.table.names), publisher.path)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        publisher.close()
+        rig.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# 虚拟电台: 在伪终端(pty)上模拟设备应答CAT命令, 无硬件时测试和压测串口收发路径.
+# 1. _GET命令的初始应答取配置中的DEBUG值, _SET命令按DIM/CONVERT配置校验参数后更新状态,
+#    此后同前缀_GET的应答随之改变(八重洲CAT中SET命令与GET应答格式一致).
+# 2. 按波特率模拟字节传输时间, 并可设置设备处理延迟.
+# 3. 可注入错误应答(?;), 丢弃字节, 以及AI模式下的主动上报帧.
+#
+# 用法: python simulator.py -m FT-891 -s 38400
+#       rig.connect(sim.port, 38400) 与连接真实串口相同
+
+import os
+import re
+import tty
+import time
+import random
+import select
+import argparse
+import threading
+
+import device
+
+class RIG_SIMULATOR(object):
+    # 虚拟电台, 状态为 {GET命令前缀: 应答(不含;)}
+    def __init__(self, model='FT-891', baudrate=38400, latency=0.01,
+        error_rate=0.0, drop_rate=0.0, seed=None, rig=None, channels=20):
+        '''
+        latency: 应答延迟(秒, 设备处理及USB串口转换的往返延迟), 每批命令计一次,
+                 之后应答按波特率的字节时间发出
+        error_rate: 以此概率应答'?;'
+        drop_rate: 应答中每个字节以此概率被丢弃
+        rig: 提供配置的YAESU_CAT实例, 默认由RIG_CREATOR按model创建
+        channels: 预置的存储频道数(MR/MW), 频率依次递增1kHz, 其余频道为空
+        '''
+        rig = rig or device.RIG_CREATOR().get(model)
+        self.model = model
+        self.baudrate = baudrate
+        self.latency = latency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.ai = False
+        self.rx_count = 0       # 收到的命令数
+        self.tx_count = 0       # 发出的应答帧数
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+
+        # _GET: 命令前缀 -> 当前应答; _SET: (常量前缀, 参数校验正则)
+        self.__replies = {}
+        self.__sets = []
+        for func_name, plan in rig.get_plans().iteritems():
+            if plan.is_get and len(plan.parts) == 1 and plan.debug:
+                self.__replies[plan.prefix] = plan.debug.rstrip(';')
+            elif not plan.is_get:
+                self.__sets.append((plan.parts[0], self.__set_pattern(plan, rig.get_func(func_name))))
+
+        # 存储频道: 频道号(3位) -> MR应答中频道号之后的部分
+        self.__memory = {}
+        plan = rig.get_plans().get('MEMORY_CHANNEL_GET')
+        if plan is not None and plan.debug:
+            template = plan.debug.rstrip(';')[5:]
+            for ch in range(1, channels + 1):
+                self.__memory['%03d' % ch] = '%09d' % (int(template[:9]) + ch * 1000) + template[9:]
+
+        self.__master, self.__slave = os.openpty()
+        tty.setraw(self.__slave)
+        self.port = os.ttyname(self.__slave)
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__loop, name='SIM-%s' % model)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __set_pattern(self, plan, func_conf):
+        ''' 按SET模板生成校验正则: DIM参数取码值, CONVERT参数按FORM宽度, 其余任意 '''
+        dim = func_conf.get('DIM') or {}
+        convert = func_conf.get('CONVERT') or {}
+        regex = []
+        for i, part in enumerate(plan.parts):
+            if i % 2 == 0:
+                regex.append(re.escape(part.rstrip(';')))
+            elif isinstance(dim.get(part), dict):
+                regex.append('(?:%s)' % '|'.join(re.escape(str(v)) for v in dim[part].values()))
+            elif isinstance(convert.get(part), dict) and str(convert[part].get('FORM', '')).count('|') == 2:
+                regex.append('.{%d}' % int(str(convert[part]['FORM']).split('|')[1]))
+            else:
+                regex.append('.+')
+        return re.compile(''.join(regex) + '$')
+
+    def close(self):
+        self.__running = False
+        self.__thread.join()
+        os.close(self.__master)
+        os.close(self.__slave)
+
+    ############################ 状态和注入 ############################
+
+    def get_state(self, prefix):
+        ''' 读取某GET前缀的当前应答 '''
+        return self.__replies.get(prefix)
+
+    def set_state(self, frame):
+        '''
+        模拟面板操作改变状态, frame为完整应答(可含;), 如'FA007100000'.
+        AI模式下同时主动上报该帧.
+        '''
+        frame = frame.rstrip(';')
+        prefix = self.__match(frame)
+        if prefix is None:
+            return False
+        self.__replies[prefix] = frame
+        if self.ai:
+            self.inject(frame)
+        return True
+
+    def inject(self, frame):
+        ''' 主动发出一帧(如AI帧或干扰帧), 不改变状态 '''
+        self.__send(frame.rstrip(';') + ';', delay=False)
+
+    ############################ 命令处理 ############################
+
+    def __match(self, body):
+        ''' 按最长前缀匹配GET状态, 且应答长度一致 '''
+        best = None
+        for prefix, reply in self.__replies.iteritems():
+            if body.startswith(prefix) and len(body) == len(reply):
+                if best is None or len(prefix) > len(best):
+                    best = prefix
+        return best
+
+    def handle(self, body):
+        ''' 处理一条命令(不含;), 返回应答(含;)或None '''
+        self.rx_count += 1
+        if body == 'AI':
+            return 'AI%d;' % self.ai
+        if body in ('AI0', 'AI1'):
+            self.ai = body == 'AI1'
+            return
+        if self.error_rate and self.__random.random() < self.error_rate:
+            return '?;'
+
+        # 存储频道读写
+        if body.startswith('MR') and len(body) == 5:
+            data = self.__memory.get(body[2:])
+            return 'MR%s%s;' % (body[2:], data) if data else '?;'
+        if body.startswith('MW') and self.__memory:
+            if len(body) <> 5 + len(self.__memory.values()[0]):
+                return '?;'
+            self.__memory[body[2:5]] = body[5:]
+            return
+
+        # GET: 命令即前缀
+        reply = self.__replies.get(body)
+        if reply is not None:
+            return reply + ';'
+
+        # SET: 校验参数, 若有对应GET状态则更新, AI模式下回显新状态
+        for literal, pattern in self.__sets:
+            if body.startswith(literal.rstrip(';')) and pattern.match(body):
+                prefix = self.__match(body)
+                if prefix is not None:
+                    changed = self.__replies[prefix] <> body
+                    self.__replies[prefix] = body
+                    if changed and self.ai:
+                        return body + ';'
+                return
+        return '?;'
+
+    def __send(self, data, delay=True):
+        if self.drop_rate:
+            data = ''.join(c for c in data if self.__random.random() >= self.drop_rate)
+        if delay:
+            time.sleep(self.latency)
+        # 按波特率模拟传输时间
+        time.sleep(len(data) * device.byte_time(self.baudrate))
+        with self.__lock:
+            os.write(self.__master, data)
+        self.tx_count += data.count(';')
+
+    def __loop(self):
+        buf = ''
+        while self.__running:
+            readable = select.select([self.__master], [], [], 0.1)[0]
+            if not readable:
+                continue
+            try:
+                buf += os.read(self.__master, 4096)
+            except OSError:
+                break
+            commands = buf.split(';')
+            buf = commands.pop()
+            # 一次读入的多条命令视为同一批, 处理延迟只计一次, 应答连续发出
+            replies = ''.join(filter(None, [self.handle(body) for body in commands]))
+            if replies:
+                self.__send(replies)
+
+def main():
+    parser = argparse.ArgumentParser(description='virtual Yaesu rig on a pseudo-terminal')
+    parser.add_argument('-m', '--model', default='FT-891')
+    parser.add_argument('-s', '--serial-speed', type=int, default=38400)
+    parser.add_argument('-l', '--latency', type=float, default=0.01)
+    parser.add_argument('-e', '--error-rate', type=float, default=0.0)
+    parser.add_argument('-d', '--drop-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    sim = RIG_SIMULATOR(args.model, args.serial_speed, args.latency, args.error_rate, args.drop_rate)
+    print 'simulated %s on %s @ %d' % (args.model, sim.port, args.serial_speed)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        sim.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# 频段扫描: 按频率列表设置VFO_A_FREQ_SET并读取METER_S_READING_GET, 结果为(频率, S值)数组.
+# 1. 设置和读取在一次写入中完成(func_exec_seq): settle为0时多个频点一次写入;
+#    否则每次写入为 读取当前频点 + 设置下一频点, 等待稳定时间与读取往返重叠.
+# 2. 粗扫后可在峰值附近以小步进细扫(refine).
+# 3. 每批结果追加到断点文件, 中断后以同一断点文件重新执行时跳过已完成的频点.
+#
+# 用法: python sweep.py -m FT-891 -r /dev/ttyUSB0 -s 38400 --start 7000000 --stop 7200000 --step 1000
+
+import os
+import sys
+import time
+import array
+import struct
+import argparse
+
+import device
+
+NAN = float('nan')
+
+_RECORD = struct.Struct('<qd')      # 断点文件记录: 频率(Hz), S值
+
+def freq_range(start, stop, step):
+    ''' 生成 start 到 stop(含) 的频率列表 '''
+    assert step > 0, 'step must > 0'
+    return range(int(start), int(stop) + 1, int(step))
+
+class SWEEP_RESULT(object):
+    # 扫描结果, 频率(Hz)和S值分别存于array, 按频率升序, 未读到的S值为NaN
+    def __init__(self):
+        self.__data = {}
+        self.__arrays = None    # 合并后按需重建的 (freqs, levels)
+
+    def __len__(self):
+        return len(self.__data)
+
+    def __iter__(self):
+        return iter(zip(self.freqs, self.levels))
+
+    def __contains__(self, freq):
+        return freq in self.__data
+
+    def __build(self):
+        if self.__arrays is None:
+            freqs = array.array('l', sorted(self.__data))
+            self.__arrays = (freqs, array.array('d', [self.__data[f] for f in freqs]))
+        return self.__arrays
+
+    @property
+    def freqs(self):
+        return self.__build()[0]
+
+    @property
+    def levels(self):
+        return self.__build()[1]
+
+    def update(self, pairs):
+        ''' 合并 [(频率, S值), ...], 同频率以新值覆盖 '''
+        self.__data.update(pairs)
+        self.__arrays = None
+
+    def level(self, freq):
+        return self.__data.get(freq)
+
+    def peaks(self, threshold=None, top=None):
+        '''
+        局部峰值频率列表, 按S值降序. 峰值不低于两侧相邻点, 且不低于threshold(默认为中位数).
+        '''
+        valid = sorted(v for v in self.levels if v == v)
+        if not valid:
+            return []
+        if threshold is None:
+            threshold = valid[len(valid) // 2]
+        levels = self.levels
+        found = []
+        for i in range(len(levels)):
+            v = levels[i]
+            if v <> v or v < threshold:
+                continue
+            left = levels[i - 1] if i > 0 else NAN
+            right = levels[i + 1] if i + 1 < len(levels) else NAN
+            if (left <> left or v > left) and (right <> right or v >= right):
+                found.append((v, self.freqs[i]))
+        found.sort(reverse=True)
+        return [f for v, f in found[:top]]
+
+class SWEEP(object):
+    # 扫描引擎, 使用已连接的YAESU_CAT实例
+    def __init__(self, rig, settle=0.0, batch=16, checkpoint=None,
+        freq_func='VFO_A_FREQ_SET', meter_func='METER_S_READING_GET'):
+        '''
+        settle: 设置频率后到读取S值前的等待时间(秒)
+        batch: settle为0时每次写入的频点数
+        checkpoint: 断点文件路径, None为不保存
+        '''
+        self.rig = rig
+        self.settle = settle
+        self.batch = batch if not settle else 1
+        self.checkpoint = checkpoint
+        self.freq_func = freq_func
+        self.meter_func = meter_func
+        self.result = SWEEP_RESULT()
+        self.complete = False
+        self.__tuned = None     # 设备当前已设置的频率
+        if checkpoint and os.path.exists(checkpoint):
+            self.result.update(self.load_checkpoint(checkpoint))
+
+    @staticmethod
+    def load_checkpoint(path):
+        ''' 读取断点文件, 返回 [(频率, S值), ...], 忽略不完整的尾记录 '''
+        with open(path, 'rb') as f:
+            data = f.read()
+        size = len(data) - len(data) % _RECORD.size
+        return [_RECORD.unpack_from(data, i) for i in range(0, size, _RECORD.size)]
+
+    def __save(self, pairs):
+        if not self.checkpoint:
+            return
+        with open(self.checkpoint, 'ab') as f:
+            f.write(''.join(_RECORD.pack(freq, level) for freq, level in pairs))
+
+    def __level(self, ret):
+        if not isinstance(ret, dict) or not ret.has_key('VAL'):
+            return NAN
+        return float(ret['VAL'])
+
+    def run(self, freqs, callback=None):
+        '''
+        扫描频率列表, 已在结果(或断点文件)中的频点跳过. 返回SWEEP_RESULT,
+        连接失败时中止, self.complete为False, 可再次调用run继续.
+        callback(freq, level): 每个频点完成后调用
+        '''
+        todo = [int(f) for f in freqs if int(f) not in self.result]
+        self.complete = False
+
+        for i in range(0, len(todo), self.batch):
+            chunk = todo[i:i + self.batch]
+            following = todo[i + self.batch] if i + self.batch < len(todo) else None
+            pairs = self.__step(chunk, following)
+            if pairs is None:
+                self.rig.logger.error('sweep interrupted at %d Hz.' % chunk[0])
+                return self.result
+            self.result.update(pairs)
+            self.__save(pairs)
+            if callback is not None:
+                for freq, level in pairs:
+                    callback(freq, level)
+
+        self.complete = True
+        return self.result
+
+    def __step(self, chunk, following):
+        '''
+        一次写入完成一批频点: [设置f1, 读取, 设置f2, 读取, ...].
+        settle不为0时, 批次只有一个频点且已提前设置, 写入 [读取, 设置下一频点], 之后等待settle.
+        '''
+        items = []
+        for freq in chunk:
+            if freq <> self.__tuned:
+                items.append((self.freq_func, {'FREQ': freq}))
+            items.append(self.meter_func)
+        if self.settle and following is not None:
+            items.append((self.freq_func, {'FREQ': following}))
+
+        if self.settle and chunk[0] <> self.__tuned:
+            # 首个频点: 先单独设置并等待稳定
+            if self.rig.func_exec_seq(items[:1]) is None:
+                self.__tuned = None
+                return
+            time.sleep(self.settle)
+            items = items[1:]
+
+        ret = self.rig.func_exec_seq(items)
+        if ret is None:
+            self.__tuned = None
+            return
+        self.__tuned = following if self.settle and following is not None else chunk[-1]
+
+        levels = [self.__level(r) for item, r in zip(items, ret) if isinstance(item, basestring)]
+        if self.settle and following is not None:
+            time.sleep(self.settle)
+        return zip(chunk, levels)
+
+    def sweep(self, start, stop, step, callback=None):
+        return self.run(freq_range(start, stop, step), callback)
+
+    def refine(self, coarse_step, fine_step, top=5, threshold=None, callback=None):
+        '''
+        在粗扫结果的峰值两侧(各coarse_step)以fine_step细扫, 结果合并到self.result.
+        返回细扫的峰值频率列表.
+        '''
+        peaks = self.result.peaks(threshold, top)
+        freqs = []
+        for peak in peaks:
+            freqs.extend(freq_range(peak - coarse_step, peak + coarse_step, fine_step))
+        self.run(sorted(set(freqs)), callback)
+        refined = []
+        for peak in peaks:
+            near = [(v, f) for f, v in self.result
+                if abs(f - peak) <= coarse_step and v == v]
+            if near:
+                refined.append(max(near)[1])
+        return refined
+
+def main():
+    parser = argparse.ArgumentParser(description='Yaesu band sweep')
+    parser.add_argument('-m', '--model', default='FT-891')
+    parser.add_argument('-r', '--rig-file', required=True, help='串口设备')
+    parser.add_argument('-s', '--serial-speed', type=int, default=38400)
+    parser.add_argument('--start', type=int, required=True, help='起始频率(Hz)')
+    parser.add_argument('--stop', type=int, required=True, help='终止频率(Hz)')
+    parser.add_argument('--step', type=int, required=True, help='步进(Hz)')
+    parser.add_argument('--settle', type=float, default=0.0, help='稳定等待时间(秒)')
+    parser.add_argument('--fine-step', type=int, help='峰值附近细扫步进(Hz)')
+    parser.add_argument('--top', type=int, default=5, help='细扫的峰值数')
+    parser.add_argument('-c', '--checkpoint', help='断点文件, 中断后以相同参数重新执行即可继续')
+    args = parser.parse_args()
+
+    rig = device.RIG_CREATOR().get(args.model)
+    if rig is None or not rig.connect(args.rig_file, args.serial_speed):
+        sys.exit(1)
+    engine = SWEEP(rig, args.settle, checkpoint=args.checkpoint)
+    begin = time.time()
+    engine.sweep(args.start, args.stop, args.step)
+    if engine.complete and args.fine_step:
+        print 'peaks:', engine.refine(args.step, args.fine_step, args.top)
+    for freq, level in engine.result:
+        print '%d\t%s' % (freq, level)
+    print '%d points in %.2fs' % (len(engine.result), time.time() - begin)
+    rig.close()
+    sys.exit(0 if engine.complete else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# 表头遥测记录: 按链路允许的最高速率批量读取表头(func_exec_many, 一次写入全部命令),
+# 数据存入定长数组环形缓冲区, 长时间运行内存固定.
+# 1. 原始采样保存最近 capacity 个点, 另按时间窗(window秒)聚合 min/max/mean,
+#    保存最近 window_capacity 个窗口, 用于数小时的历史(如比赛期间的SWR和末级电流).
+# 2. 可同时写入只追加的列式二进制文件, 由 load_columns 读回.
+#
+# 用法: python telemetry.py -m FT-891 -r /dev/ttyUSB0 -s 38400 -o contest.tlm
+
+import os
+import sys
+import time
+import array
+import struct
+import argparse
+import threading
+
+import device
+
+DEFAULT_METERS = (
+    'METER_S_GET', 'METER_POW_GET', 'METER_SWR_GET', 'METER_ALC_GET',
+    'METER_IDD_GET', 'METER_CMP_GET', 'METER_S_READING_GET')
+
+NAN = float('nan')
+
+def _meter_value(ret):
+    ''' 表头功能的解析结果 {'VAL': x} 转为浮点数, 失败为NaN '''
+    if not isinstance(ret, dict) or not ret:
+        return NAN
+    val = ret['VAL'] if ret.has_key('VAL') else ret.values()[0]
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return NAN
+
+class RING_BUFFER(object):
+    # 定长环形缓冲区, 以array存储, 写满后覆盖最旧数据
+    def __init__(self, capacity, typecode='d'):
+        assert capacity > 0, 'capacity must > 0'
+        self.capacity = capacity
+        self.__data = array.array(typecode, [0] * capacity)
+        self.__index = 0        # 下一个写入位置
+        self.__count = 0
+
+    def __len__(self):
+        return self.__count
+
+    def append(self, value):
+        self.__data[self.__index] = value
+        self.__index = (self.__index + 1) % self.capacity
+        if self.__count < self.capacity:
+            self.__count += 1
+
+    def clear(self):
+        self.__index = 0
+        self.__count = 0
+
+    def values(self, n=None):
+        ''' 返回最近n个(默认全部)数据, 按时间先后排列的array '''
+        n = self.__count if n is None else min(n, self.__count)
+        begin = (self.__index - n) % self.capacity
+        if begin + n <= self.capacity:
+            return self.__data[begin:begin + n]
+        return self.__data[begin:] + self.__data[:self.__index]
+
+    def last(self):
+        if self.__count:
+            return self.__data[self.__index - 1]
+
+def aggregate(values):
+    ''' 返回 (min, max, mean), 忽略NaN; 无有效数据时全为NaN '''
+    valid = [v for v in values if v == v]
+    if not valid:
+        return (NAN, NAN, NAN)
+    return (min(valid), max(valid), sum(valid) / len(valid))
+
+def downsample(times, values, window):
+    '''
+    按时间窗降采样, times/values为等长序列, 返回 [(窗口起始时间, min, max, mean), ...]
+    窗口以window的整数倍对齐, 空窗口不输出.
+    '''
+    result = []
+    bucket, start = [], None
+    for t, v in zip(times, values):
+        w = t - t % window
+        if w <> start:
+            if bucket:
+                result.append((start,) + aggregate(bucket))
+            bucket, start = [], w
+        bucket.append(v)
+    if bucket:
+        result.append((start,) + aggregate(bucket))
+    return result
+
+############################ 列式文件 ############################
+#
+# 文件头: MAGIC(4s) VERSION(B) 字节序(c, '<'或'>') 列数(H), 每列: 名称长度(B) 名称
+# 数据块: BLOCK(4s) 行数(I), 之后每列依次为 行数 个double
+# 文件只追加, 进程中断时最多丢失未写入的一个块, 不完整的尾块读取时忽略.
+
+FILE_MAGIC = 'YTLM'
+FILE_VERSION = 1
+BLOCK_MAGIC = 'BLK0'
+_HEADER = struct.Struct('<4sBcH')
+_BLOCK = struct.Struct('<4sI')
+_BYTEORDER = '<' if sys.byteorder == 'little' else '>'
+
+def _read_header(f):
+    magic, version, byteorder, ncols = _HEADER.unpack(f.read(_HEADER.size))
+    assert magic == FILE_MAGIC, 'not a telemetry file.'
+    assert version == FILE_VERSION, 'unsupported telemetry file version: %d' % version
+    names = []
+    for i in range(ncols):
+        size = ord(f.read(1))
+        names.append(f.read(size))
+    return names, byteorder
+
+class COLUMN_WRITER(object):
+    # 列式文件写入, 每 block_rows 行写一个数据块
+    def __init__(self, path, columns, block_rows=256):
+        self.path = path
+        self.columns = list(columns)
+        self.block_rows = block_rows
+        self.__buffers = [array.array('d') for c in self.columns]
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            # 追加到已有文件, 列须一致
+            with open(path, 'rb') as f:
+                names, byteorder = _read_header(f)
+            assert names == self.columns, 'columns mismatch with [%s]: %s' % (path, names)
+            assert byteorder == _BYTEORDER, 'byte order mismatch with [%s]' % path
+            self.__file = open(path, 'ab')
+        else:
+            self.__file = open(path, 'wb')
+            self.__file.write(_HEADER.pack(FILE_MAGIC, FILE_VERSION, _BYTEORDER, len(self.columns)))
+            for name in self.columns:
+                self.__file.write(chr(len(name)) + name)
+            self.__file.flush()
+
+    def append(self, row):
+        ''' 追加一行, row与columns等长 '''
+        for buf, value in zip(self.__buffers, row):
+            buf.append(value)
+        if len(self.__buffers[0]) >= self.block_rows:
+            self.flush()
+
+    def flush(self):
+        rows = len(self.__buffers[0])
+        if not rows:
+            return
+        self.__file.write(_BLOCK.pack(BLOCK_MAGIC, rows))
+        for buf in self.__buffers:
+            buf.tofile(self.__file)
+        self.__file.flush()
+        self.__buffers = [array.array('d') for c in self.columns]
+
+    def close(self):
+        self.flush()
+        self.__file.close()
+
+def iter_blocks(path):
+    ''' 逐块读取列式文件, 生成 (列名列表, [每列array]) '''
+    with open(path, 'rb') as f:
+        names, byteorder = _read_header(f)
+        while True:
+            head = f.read(_BLOCK.size)
+            if len(head) < _BLOCK.size:
+                break
+            magic, rows = _BLOCK.unpack(head)
+            if magic <> BLOCK_MAGIC:
+                break
+            block = []
+            try:
+                for name in names:
+                    col = array.array('d')
+                    col.fromfile(f, rows)
+                    if byteorder <> _BYTEORDER:
+                        col.byteswap()
+                    block.append(col)
+            except EOFError:
+                break       # 不完整的尾块
+            yield names, block
+
+def load_columns(path):
+    ''' 读取整个列式文件, 返回 {列名: array('d')} '''
+    columns = None
+    for names, block in iter_blocks(path):
+        if columns is None:
+            columns = [array.array('d') for name in names]
+        for col, data in zip(columns, block):
+            col.extend(data)
+    if columns is None:
+        with open(path, 'rb') as f:
+            names = _read_header(f)[0]
+        columns = [array.array('d') for name in names]
+    return dict(zip(names, columns))
+
+############################ 记录器 ############################
+
+class TELEMETRY_RECORDER(object):
+    # 表头遥测记录器, 后台线程批量采样
+    def __init__(self, rig, funcs=DEFAULT_METERS, capacity=10000, window=1.0,
+        window_capacity=86400, path=None):
+        '''
+        rig: 已连接的YAESU_CAT实例
+        funcs: 采样的表头_GET功能
+        capacity: 原始采样保存点数
+        window: 聚合时间窗(秒), window_capacity: 保存的窗口数
+        path: 列式文件路径, 列为 TIME + funcs, None为不写文件
+        '''
+        self.rig = rig
+        self.funcs = [f.upper() if f.upper().endswith('_GET') else f.upper() + '_GET' for f in funcs]
+        self.window = window
+        self.samples = 0        # 采样次数
+        self.errors = 0         # 采样中失败的读数
+        self.__lock = threading.Lock()
+        self.__times = RING_BUFFER(capacity)
+        self.__values = dict((f, RING_BUFFER(capacity)) for f in self.funcs)
+        # 时间窗聚合: 窗口起始时间, 及每个功能的 min/max/mean
+        self.__win_times = RING_BUFFER(window_capacity)
+        self.__win_values = dict((f, (RING_BUFFER(window_capacity), RING_BUFFER(window_capacity),
+            RING_BUFFER(window_capacity))) for f in self.funcs)
+        self.__win_start = None
+        self.__win_bucket = dict((f, []) for f in self.funcs)
+        self.__writer = COLUMN_WRITER(path, ['TIME'] + self.funcs) if path else None
+        self.__thread = None
+        self.__running = False
+        self.__wake = threading.Event()     # stop()时唤醒断线等待
+
+    def sample_once(self):
+        '''
+        批量读取一次所有表头并记录, 返回 {功能名: 数值}.
+        连接不可用或全部读数失败(如读取中串口断开)时不记录, 返回None.
+        '''
+        ret = self.rig.func_exec_many(self.funcs)
+        if ret is None:
+            return
+        ts = time.time()
+        row = [_meter_value(ret.get(f)) for f in self.funcs]
+        if all(v <> v for v in row):
+            with self.__lock:
+                self.errors += len(row)
+            return
+        with self.__lock:
+            self.samples += 1
+            self.errors += len([v for v in row if v <> v])
+            self.__times.append(ts)
+            for f, v in zip(self.funcs, row):
+                self.__values[f].append(v)
+            self.__window_add(ts, row)
+            if self.__writer is not None:
+                self.__writer.append([ts] + row)
+        return dict(zip(self.funcs, row))
+
+    def __window_add(self, ts, row):
+        start = ts - ts % self.window
+        if start <> self.__win_start:
+            self.__window_close()
+            self.__win_start = start
+        for f, v in zip(self.funcs, row):
+            self.__win_bucket[f].append(v)
+
+    def __window_close(self):
+        if self.__win_start is None:
+            return
+        self.__win_times.append(self.__win_start)
+        for f in self.funcs:
+            for ring, value in zip(self.__win_values[f], aggregate(self.__win_bucket[f])):
+                ring.append(value)
+            self.__win_bucket[f] = []
+
+    def start(self, interval=0):
+        ''' 后台持续采样, interval为采样间隔(秒), 0为链路允许的最高速率 '''
+        if self.__running:
+            return
+        self.__running = True
+        self.__wake.clear()
+        self.__thread = threading.Thread(target=self.__loop, args=(interval,), name='TELEMETRY')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        ''' 停止采样, 关闭当前时间窗并写完文件 '''
+        self.__running = False
+        self.__wake.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        with self.__lock:
+            self.__window_close()
+            self.__win_start = None
+            if self.__writer is not None:
+                self.__writer.flush()
+
+    def close(self):
+        self.stop()
+        if self.__writer is not None:
+            self.__writer.close()
+            self.__writer = None
+
+    def __loop(self, interval):
+        while self.__running:
+            begin = time.time()
+            try:
+                ret = self.sample_once()
+            except Exception, e:
+                self.rig.logger.error('telemetry sample error: %s' % e)
+                time.sleep(1)
+                continue
+            if ret is None:
+                self.__wait_connected()
+            elif interval:
+                time.sleep(max(interval - (time.time() - begin), 0))
+
+    def __wait_connected(self):
+        '''
+        连接不可用(func_exec_many立即失败)或全部读数失败时退避, 不空转采样:
+        有连接监控时等待其重连, 否则等待rig.reconnect_interval秒后由下次采样尝试重连
+        '''
+        supervisor = self.rig.supervisor
+        if supervisor is not None:
+            supervisor.wait_connected(self.rig.reconnect_interval)
+        else:
+            self.__wake.wait(self.rig.reconnect_interval)
+
+    ############################ 读取 ############################
+
+    def latest(self):
+        ''' 最近一次采样 (时间, {功能名: 数值}) '''
+        with self.__lock:
+            if not len(self.__times):
+                return
+            return self.__times.last(), dict((f, self.__values[f].last()) for f in self.funcs)
+
+    def series(self, func_name, n=None):
+        ''' 最近n个原始采样, 返回 (时间array, 数值array) '''
+        with self.__lock:
+            return self.__times.values(n), self.__values[func_name].values(n)
+
+    def downsample(self, func_name, window, n=None):
+        ''' 对最近n个原始采样按window秒降采样, 返回 [(窗口起始时间, min, max, mean), ...] '''
+        times, values = self.series(func_name, n)
+        return downsample(times, values, window)
+
+    def history(self, func_name, n=None):
+        ''' 最近n个已完成时间窗的聚合, 返回 [(窗口起始时间, min, max, mean), ...] '''
+        with self.__lock:
+            mins, maxs, means = self.__win_values[func_name]
+            return zip(self.__win_times.values(n), mins.values(n), maxs.values(n), means.values(n))
+
+    def rate(self):
+        ''' 原始缓冲区内的平均采样率(次/秒) '''
+        with self.__lock:
+            times = self.__times.values()
+        if len(times) < 2 or times[-1] == times[0]:
+            return 0.0
+        return (len(times) - 1) / (times[-1] - times[0])
+
+def main():
+    parser = argparse.ArgumentParser(description='Yaesu meter telemetry recorder')
+    parser.add_argument('-m', '--model', default='FT-891')
+    parser.add_argument('-r', '--rig-file', required=True, help='串口设备')
+    parser.add_argument('-s', '--serial-speed', type=int, default=38400)
+    parser.add_argument('-o', '--output', help='列式文件路径')
+    parser.add_argument('-f', '--funcs', nargs='+', default=list(DEFAULT_METERS))
+    parser.add_argument('-i', '--interval', type=float, default=0, help='采样间隔(秒), 0为最高速率')
+    parser.add_argument('-w', '--window', type=float, default=1.0, help='聚合时间窗(秒)')
+    args = parser.parse_args()
+
+    rig = device.RIG_CREATOR().get(args.model)
+    if rig is None or not rig.connect(args.rig_file, args.serial_speed):
+        sys.exit(1)
+    recorder = TELEMETRY_RECORDER(rig, args.funcs, window=args.window, path=args.output)
+    recorder.start(args.interval)
+    try:
+        while True:
+            time.sleep(args.window)
+            for func_name in recorder.funcs:
+                hist = recorder.history(func_name, 1)
+                if hist:
+                    print '%-20s min %6.1f max %6.1f mean %6.1f' % ((func_name,) + hist[0][1:])
+            print '%.1f samples/s' % recorder.rate()
+    except KeyboardInterrupt:
+        recorder.close()
+        rig.close()
+
+if __name__ == '__main__':
+    main()